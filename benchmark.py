@@ -0,0 +1,709 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+# Benchmarks run without a window or an audio device
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import main
+
+# Scripted input: (frame, event type, key). Repeats every SCRIPT_LENGTH frames
+SCRIPT_LENGTH = 240
+INPUT_SCRIPT = [
+    (0, pygame.KEYDOWN, pygame.K_RIGHT),
+    (30, pygame.KEYDOWN, pygame.K_SPACE),
+    (31, pygame.KEYUP, pygame.K_SPACE),
+    (45, pygame.KEYDOWN, pygame.K_SPACE),
+    (46, pygame.KEYUP, pygame.K_SPACE),
+    (100, pygame.KEYUP, pygame.K_RIGHT),
+    (120, pygame.KEYDOWN, pygame.K_LEFT),
+    (150, pygame.KEYDOWN, pygame.K_SPACE),
+    (151, pygame.KEYUP, pygame.K_SPACE),
+    (220, pygame.KEYUP, pygame.K_LEFT),
+]
+
+# Scripted quiz answers for the replay scenario: every QUIZ_CLICK_PERIOD
+# frames, a click on the centre of one of the four answer buttons
+QUIZ_CLICK_PERIOD = 90
+QUIZ_BUTTON_CENTERS = [(main.WIDTH // 2, 280 + 80 * i) for i in range(4)]
+
+# Metrics where a higher value is better; everything else is a cost
+HIGHER_IS_BETTER = {"fps", "frames_per_sec", "hit_rate", "realtime_factor"}
+# Metric suffixes checked for regressions (maxima are too noisy to gate on)
+GATED_SUFFIXES = ("_p50", "_p99", "_ms", "_us")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_large_map(size, seed=0):
+    # Ground row plus randomly scattered platforms, like a long level
+    rng = random.Random(seed)
+    tilemap = main.TileMap(size, size, ["grass", "dirt", "stone"])
+    tilemap.fill(0, size - 2, size, 2, "dirt")
+    for _ in range(size * size // 64):
+        tx = rng.randrange(size)
+        ty = rng.randrange(size - 2)
+        tilemap.fill(tx, ty, rng.randint(3, 8), 1, rng.choice(("grass", "stone")))
+    return tilemap
+
+
+def build_level(blocks, seed=0):
+    # A 256-tile wide level with the usual ground row and `blocks` solid tiles
+    # in total, the rest spread over random platforms
+    rng = random.Random(seed)
+    width = 256
+    height = max(25, blocks // width * 4 + 25)
+    tilemap = main.TileMap(width, height, ["grass", "dirt", "stone"])
+    tilemap.fill(0, 23, width, 1, "dirt")
+    while tilemap.solid_count() < blocks:
+        tx = rng.randrange(width)
+        ty = rng.choice([rng.randrange(0, 19), rng.randrange(24, height)])
+        tilemap.fill(tx, ty, rng.randint(3, 8), 1, rng.choice(("grass", "stone")))
+    return tilemap
+
+
+def save_temp_level(tilemap, name):
+    path = os.path.join(tempfile.gettempdir(), f"bench_{name}.p5map")
+    tilemap.save(path)
+    return path
+
+
+def make_game(blocks, npcs, seed=0):
+    random.seed(seed)
+    game = main.Game(headless=True, seed=seed)
+    if blocks:
+        path = save_temp_level(build_level(blocks, seed), f"level_{blocks}")
+        game.create_level(path)
+        os.remove(path)
+    rng = random.Random(seed)
+    for _ in range(npcs):
+        npc = main.NPC(rng.randrange(100, main.WIDTH - 100), rng.randrange(100, 400), "Rock Head",
+                       game.rng)
+        game.add_npc(npc)
+    return game
+
+
+def post_scripted_input(frame):
+    for at, event_type, key in INPUT_SCRIPT:
+        if frame % SCRIPT_LENGTH == at:
+            pygame.event.post(pygame.event.Event(event_type, key=key, mod=0, unicode=""))
+
+
+def post_quiz_clicks(frame):
+    if frame % QUIZ_CLICK_PERIOD == QUIZ_CLICK_PERIOD - 1:
+        pos = QUIZ_BUTTON_CENTERS[frame // QUIZ_CLICK_PERIOD % len(QUIZ_BUTTON_CENTERS)]
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1))
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=pos, button=1))
+
+
+# Hard limits checked by scenarios; any failure makes the run exit non-zero
+FAILURES = []
+
+
+def require(scenario, condition, message):
+    if not condition:
+        FAILURES.append(f"{scenario}: {message}")
+
+
+def run_frames(game, frames, draw=True, scripted=True):
+    # One fixed step per frame; returns per-frame times in milliseconds
+    times = []
+    for frame in range(frames):
+        if scripted:
+            post_scripted_input(frame)
+        start = time.perf_counter()
+        game.systems.begin_frame()
+        game.events()
+        game.update()
+        game.frame_clock.step()
+        if draw:
+            game.draw()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def count_system_calls(game, frames):
+    # Frames paced by a FrameClock like Game.frame_loop, with a 50 ms stall
+    # every 10th frame so the clock catches up with several steps. Every
+    # system has to run exactly once per simulation step, not per frame;
+    # returns the most runs per step of any system (should be 1.0) and the
+    # number of frames that simulated more than one step
+    clock = main.FrameClock()
+    most = 0.0
+    catch_up = 0
+    for frame in range(frames):
+        steps = clock.tick()
+        post_scripted_input(frame)
+        game.systems.begin_frame()
+        game.events(steps=steps)
+        for _ in range(steps):
+            game.update()
+            clock.step()
+        calls = game.systems.calls
+        require("update", all(count == steps for count in calls.values()),
+                f"systems ran {calls} times in a frame of {steps} steps")
+        if steps:
+            most = max(most, max(calls.values()) / steps)
+        catch_up += steps > 1
+        time.sleep(clock.frame_delay() + (0.05 if frame % 10 == 9 else 0.0))
+    return most, catch_up
+
+
+def measure_allocations(game, frames, draw=True, scripted=True):
+    # Transient memory allocated within a frame (tracemalloc peak above the
+    # frame's starting point) and net allocated blocks left behind per frame
+    tracemalloc.start()
+    per_frame = []
+    blocks_before = sys.getallocatedblocks()
+    for frame in range(frames):
+        if scripted:
+            post_scripted_input(frame)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        game.events()
+        game.update()
+        game.frame_clock.step()
+        if draw:
+            game.draw()
+        _, peak = tracemalloc.get_traced_memory()
+        per_frame.append(peak - current)
+    tracemalloc.stop()
+    return {
+        "alloc_kb_per_frame_p50": round(percentile(per_frame, 50) / 1024, 2),
+        "alloc_kb_per_frame_max": round(max(per_frame) / 1024, 2),
+        "net_blocks_per_frame": round((sys.getallocatedblocks() - blocks_before) / frames, 2),
+    }
+
+
+def frame_stats(times):
+    total = sum(times)
+    return {
+        "frames": len(times),
+        "fps": round(len(times) / (total / 1000), 1) if total else 0.0,
+        "frame_ms_p50": round(percentile(times, 50), 3),
+        "frame_ms_p99": round(percentile(times, 99), 3),
+        "frame_ms_max": round(max(times), 3),
+    }
+
+
+def bench_frame_loop(args, dialog=False):
+    game = make_game(args.blocks, args.npcs, args.seed)
+    if dialog:
+        game.npc.open_dialog()
+    run_frames(game, min(60, args.frames))  # warm up caches
+    results = {"blocks": args.blocks, "npcs": args.npcs, "dialog": dialog}
+    results.update(frame_stats(run_frames(game, args.frames)))
+    results.update(measure_allocations(game, min(args.frames, 120)))
+    return results
+
+
+def bench_frame_loop_dialog(args):
+    return bench_frame_loop(args, dialog=True)
+
+
+def bench_update(args):
+    # Game.update alone, as run in headless mode
+    game = make_game(args.blocks, args.npcs, args.seed)
+    results = {"blocks": args.blocks, "npcs": args.npcs}
+    times = run_frames(game, args.frames, draw=False)
+    results.update(frame_stats(times))
+    results["frames_per_sec"] = results.pop("fps")
+    results["system_calls_per_step"], results["catch_up_frames"] = count_system_calls(game, 60)
+    return results
+
+
+def bench_crowd(args):
+    # Stress test: many NPCs at once. Memory per entity is what spawning one
+    # more NPC costs once its type (sprites, questions, fonts) is loaded
+    count = 1000
+    game = make_game(args.blocks, 0, args.seed)
+    rng = random.Random(args.seed)
+    positions = [(rng.randrange(100, main.WIDTH - 100), rng.randrange(100, 400)) for _ in range(count)]
+    main.NPC(0, 0, "Rock Head")  # load the shared type outside the measurement
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    npcs = [main.NPC(x, y, "Rock Head") for x, y in positions]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for npc in npcs:
+        game.add_npc(npc)
+
+    frames = min(args.frames, 300)
+    run_frames(game, 10, draw=False)
+    times = run_frames(game, frames, draw=False)
+    return {
+        "npcs": count,
+        "bytes_per_npc": round((after - before) / count),
+        "update_ms_p50": round(percentile(times, 50), 3),
+        "update_ms_p99": round(percentile(times, 99), 3),
+        "update_us_per_npc": round(percentile(times, 50) * 1000 / count, 3),
+    }
+
+
+def bench_question_bank(args):
+    # A large generated bank: JSONL -> SQLite index build, open, and the cost
+    # of drawing and loading the next question
+    count = 50000
+    rng = random.Random(args.seed)
+    source = os.path.join(tempfile.gettempdir(), "bench_questions.jsonl")
+    with open(source, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"category": rng.choice(("bpjs", "kesehatan", "umum")),
+                                "difficulty": rng.randint(1, 3), "question": f"Question {i}?",
+                                "options": [f"Option {j}" for j in range(4)],
+                                "correct": rng.randrange(4)}) + "\n")
+    db_path = os.path.splitext(source)[0] + ".sqlite"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    bank = main.QuestionBank.open(source)
+    build_ms = (time.perf_counter() - start) * 1000
+    _, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    bank.close()
+    start = time.perf_counter()
+    bank = main.QuestionBank.open(source)
+    open_ms = (time.perf_counter() - start) * 1000
+
+    # Drawing is timed and traced in separate passes (tracemalloc slows
+    # every allocation); the traced pass starts from a cold cache again
+    deck = bank.deck("kesehatan", 2, random.Random(args.seed))
+    draws = min(len(deck), 20000)
+    start = time.perf_counter()
+    seen = set()
+    for _ in range(draws):
+        seen.add(bank.get(deck.next())["id"])
+    next_us = (time.perf_counter() - start) * 1e6 / draws
+    bank.cache.clear()
+    deck = bank.deck("kesehatan", 2, random.Random(args.seed))
+    tracemalloc.start()
+    for _ in range(draws):
+        bank.get(deck.next())
+    _, draw_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Adaptive scheduling: a simulated player who gets easier questions right
+    # more often. prefetch() runs between frames; answering is record + next
+    scheduler = main.QuestionScheduler(bank, "kesehatan", rng=random.Random(args.seed))
+    answers = 20000
+    question_id = scheduler.next()
+    prefetch_time = answer_time = 0.0
+    repeats = 0
+    for _ in range(answers):
+        start = time.perf_counter()
+        scheduler.prefetch()
+        prefetch_time += time.perf_counter() - start
+        question = bank.get(question_id)
+        outcome = "correct" if rng.random() < 0.95 - 0.15 * question["difficulty"] else "wrong"
+        start = time.perf_counter()
+        scheduler.record(question, outcome, 1.0)
+        next_id = scheduler.next()
+        answer_time += time.perf_counter() - start
+        repeats += next_id == question_id
+        question_id = next_id
+    start = time.perf_counter()
+    summary = scheduler.stats.summary()
+    accuracy_by_level = [scheduler.stats.accuracy("kesehatan", level) for level in scheduler.difficulties]
+    stats_query_us = (time.perf_counter() - start) * 1e6
+    bank.close()
+    os.remove(source)
+    os.remove(db_path)
+    return {
+        "questions": count,
+        "build_ms": round(build_ms, 1),
+        "build_peak_kb": round(build_peak / 1024, 1),
+        "open_ms": round(open_ms, 2),
+        "next_question_us": round(next_us, 2),
+        "draw_peak_kb": round(draw_peak / 1024, 1),
+        "repeats": draws - len(seen),
+        "prefetch_us": round(prefetch_time * 1e6 / answers, 2),
+        "answer_us": round(answer_time * 1e6 / answers, 2),
+        "stats_query_us": round(stats_query_us, 2),
+        "seen": summary["questions"],
+        "mastered": summary["mastered"],
+        "accuracy_by_level": [round(accuracy, 3) for accuracy in accuracy_by_level],
+        "back_to_back_repeats": repeats,
+    }
+
+
+def paced_frames(game, frames, journal=None, per_frame=0):
+    # Frames paced at main.FPS like Game.frame_loop, which sleeps until the
+    # next frame is due; background threads get that idle time. Returns the
+    # busy time of each frame (ms) and of each enqueue (us)
+    question = {"id": 1, "category": "bpjs", "difficulty": 1}
+    period = 1.0 / main.FPS
+    deadline = time.perf_counter()
+    times = []
+    enqueue = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        run_frames(game, 1, scripted=False)
+        for i in range(per_frame):
+            event_start = time.perf_counter()
+            journal.answer("Rock Head", question, "correct", 1.0, i, 1)
+            enqueue.append((time.perf_counter() - event_start) * 1e6)
+        times.append((time.perf_counter() - start) * 1000)
+        deadline += period
+        time.sleep(max(0.0, deadline - time.perf_counter()))
+    return times, enqueue
+
+
+def bench_quiz_log(args):
+    # Quiz events persisted by QuizLog's writer thread while paced frames
+    # run: the frame loop only pays for queueing, never for the disk, and
+    # the writer's GIL holds are short enough not to stretch frames. 50
+    # answers per frame is far more than a player can give. Timings are left
+    # to --compare (enqueue_us_p99 and frame_ms_p99 are gated); only a lost
+    # event fails the run
+    path = os.path.join(tempfile.gettempdir(), "bench_quiz_log.sqlite")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    per_frame = 50
+    game = make_game(args.blocks, 0, args.seed)
+    game.npc.open_dialog()
+    run_frames(game, min(60, args.frames), scripted=False)
+    # One-second blocks with and without events alternate so drift on the
+    # machine hits both sides alike (the writer idles through the quiet
+    # blocks); frame_ms_p99_increase is the median of the paired increases
+    # and is not gated, it sits around zero
+    journal = main.QuizLog(path)
+    baseline, times, enqueue, increases = [], [], [], []
+    for _ in range(max(1, args.frames // main.FPS)):
+        quiet, _ = paced_frames(game, main.FPS)
+        busy, queued = paced_frames(game, main.FPS, journal, per_frame)
+        baseline += quiet
+        times += busy
+        enqueue += queued
+        increases.append(percentile(busy, 99) - percentile(quiet, 99))
+    start = time.perf_counter()
+    journal.close()
+    drain_ms = (time.perf_counter() - start) * 1000
+
+    with sqlite3.connect(path) as db:
+        rows = db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    events = len(enqueue)
+    frame_increase = sorted(increases)[len(increases) // 2]
+    require("quiz_log", rows == events, f"{events - rows} events not written")
+    return {
+        "frames": len(times),
+        "events": events,
+        "enqueue_us_p50": round(percentile(enqueue, 50), 2),
+        "enqueue_us_p99": round(percentile(enqueue, 99), 2),
+        "enqueue_us_max": round(max(enqueue), 2),
+        "frame_ms_p99_no_log": round(percentile(baseline, 99), 3),
+        "frame_ms_p99": round(percentile(times, 99), 3),
+        "frame_ms_p99_increase": round(frame_increase, 3),
+        "frame_ms_max": round(max(times), 3),
+        "batches": journal.batches,
+        "events_per_batch": round(journal.written / journal.batches, 1) if journal.batches else 0.0,
+        "drain_ms": round(drain_ms, 1),
+        "rows": rows,
+        "lost": events - rows,
+    }
+
+
+def bench_replay(args):
+    # Headless replay of a recorded session (--recording, e.g. one saved with
+    # main.py --record), or of the scripted input recorded here. Replays are
+    # exact, so a recorded perf problem or physics bug is a fixed workload.
+    # The scripted session is recorded while drawing and answers quiz
+    # questions by clicking, so a replay (which never draws) must hit the
+    # same buttons. The NPC is out of reach in the shipped level, so both
+    # games open its dialog before the first frame. The world is paused
+    # while the dialog is open, so Escape closes it halfway through and the
+    # second half replays movement and physics
+    def new_game(seed, level=main.LEVEL_PATH):
+        game = main.Game(headless=True, quiz_log="", seed=seed, level=level)
+        if not args.recording:
+            game.npc.open_dialog(game.player)
+        return game
+
+    if args.recording:
+        recording = main.InputRecording.load(args.recording)
+    else:
+        game = new_game(args.seed)
+        game.start_recording()
+        for frame in range(args.frames):
+            post_scripted_input(frame)
+            if frame < args.frames // 2:
+                post_quiz_clicks(frame)
+            elif frame == args.frames // 2:
+                pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_ESCAPE, mod=0, unicode=""))
+                pygame.event.post(pygame.event.Event(pygame.KEYUP, key=pygame.K_ESCAPE, mod=0, unicode=""))
+            run_frames(game, 1, draw=True, scripted=False)
+        path = os.path.join(tempfile.gettempdir(), "bench_replay.p5rec")
+        game.save_recording(path)
+        recording = main.InputRecording.load(path)
+        os.remove(path)
+    game = new_game(recording.seed, recording.level)
+    start = time.perf_counter()
+    matches = game.replay(recording)
+    elapsed = time.perf_counter() - start
+    require("replay", matches, "final state differs from the recording")
+    quiz = game.npc.quiz
+    return {
+        "frames": len(recording),
+        "bytes_per_frame": round(len(recording.data) / len(recording), 2) if len(recording) else 0.0,
+        "replay_ms": round(elapsed * 1000, 1),
+        "frames_per_sec": round(len(recording) / elapsed, 1) if elapsed else 0.0,
+        "realtime_factor": round(game.frame_clock.sim_time / elapsed, 1) if elapsed else 0.0,
+        "quiz_answers": quiz.scheduler.turn - 1 if quiz is not None else 0,
+        "quiz_score": quiz.score if quiz is not None else 0,
+        "matches": matches,
+    }
+
+
+def bench_draw(args):
+    game = make_game(args.blocks, args.npcs, args.seed)
+    game.draw()
+    times = []
+    for _ in range(args.frames):
+        start = time.perf_counter()
+        game.draw()
+        times.append((time.perf_counter() - start) * 1000)
+    results = {"blocks": args.blocks, "npcs": args.npcs}
+    results.update(frame_stats(times))
+    return results
+
+
+def bench_player_movement(args):
+    # One physics step with only the player's body in the store
+    game = make_game(args.blocks, 0, args.seed)
+    player = game.player
+    calls = args.frames * 10
+    start = time.perf_counter()
+    for i in range(calls):
+        player.vel_x = 4 if (i // 60) % 2 else -4
+        game.physics.step()
+    elapsed = time.perf_counter() - start
+    return {"blocks": args.blocks, "calls": calls, "physics_step_us": round(elapsed * 1e6 / calls, 3)}
+
+
+def bench_physics_crowd(args):
+    # Hundreds of bodies running around the level, stepped in one batch
+    count = 500
+    game = make_game(args.blocks, 0, args.seed)
+    rng = random.Random(args.seed)
+    physics = game.physics
+    bodies = []
+    for _ in range(count):
+        rect = pygame.Rect(rng.randrange(0, game.tilemap.pixel_width - 64), rng.randrange(0, 600), 64, 64)
+        bodies.append(physics.add(None, rect, gravity=0.5, friction=0.9, max_speed=5))
+    times = []
+    for frame in range(args.frames):
+        if frame % 60 == 0:
+            physics.vel[bodies, 0] = [rng.choice((-4, 4)) for _ in bodies]
+            physics.driven[bodies] = True
+        start = time.perf_counter()
+        physics.step()
+        physics.sync()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "bodies": count + 1,
+        "step_ms_p50": round(percentile(times, 50), 3),
+        "step_ms_p99": round(percentile(times, 99), 3),
+        "step_us_per_body": round(percentile(times, 50) * 1000 / (count + 1), 3),
+    }
+
+
+def bench_level_build(args):
+    path = save_temp_level(build_level(args.blocks, args.seed), f"level_{args.blocks}")
+    game = main.Game(headless=True)
+    times = []
+    for _ in range(5):
+        start = time.perf_counter()
+        game.create_level(path)
+        game.terrain.draw(main.screen)  # includes baking the visible chunks
+        times.append((time.perf_counter() - start) * 1000)
+    os.remove(path)
+    return {
+        "blocks": args.blocks,
+        "create_level_ms_p50": round(percentile(times, 50), 3),
+        "create_level_ms_max": round(max(times), 3),
+    }
+
+
+def bench_level_load(args):
+    size = args.size
+    path = save_temp_level(build_large_map(size, args.seed), f"{size}x{size}")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = main.TileMap.load(path)
+    load_ms = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Collision queries and the first terrain frame on the loaded map
+    rect = pygame.Rect(0, 0, 64, 64)
+    rng = random.Random(args.seed + 1)
+    start = time.perf_counter()
+    for _ in range(10000):
+        rect.topleft = (rng.randrange(loaded.pixel_width), rng.randrange(loaded.pixel_height))
+        loaded.collide(rect)
+    query_us = (time.perf_counter() - start) * 1e6 / 10000
+
+    terrain = main.TerrainLayer()
+    terrain.set_tilemap(loaded)
+    start = time.perf_counter()
+    terrain.draw(main.screen)
+    first_frame_ms = (time.perf_counter() - start) * 1000
+
+    results = {
+        "map": f"{size}x{size}",
+        "tiles": size * size,
+        "solid_tiles": loaded.solid_count(),
+        "file_bytes": os.path.getsize(path),
+        "load_ms": round(load_ms, 2),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "collide_us": round(query_us, 2),
+        "first_terrain_frame_ms": round(first_frame_ms, 2),
+    }
+    os.remove(path)
+    return results
+
+
+def bench_startup(args):
+    # Cold start in a fresh process: imports, asset decodes, level, first frame
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "main.py", "--headless", "--frames", "1"],
+                       check=True, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append((time.perf_counter() - start) * 1000)
+
+    # Warm start in this process: Game() up to the first presented frame
+    main.ASSETS.clear()
+    main.REGISTRY.clear()
+    game = main.Game(headless=True)
+    game.draw()
+    return {
+        "process_ms_p50": round(percentile(times, 50), 1),
+        "time_to_first_frame_ms": round(game.time_to_first_frame, 2),
+        "asset_decodes": main.ASSETS.stats()["decodes"],
+    }
+
+
+SCENARIOS = {
+    "startup": bench_startup,
+    "level_build": bench_level_build,
+    "level_load": bench_level_load,
+    "player_movement": bench_player_movement,
+    "physics_crowd": bench_physics_crowd,
+    "update": bench_update,
+    "crowd": bench_crowd,
+    "question_bank": bench_question_bank,
+    "replay": bench_replay,
+    "quiz_log": bench_quiz_log,
+    "draw": bench_draw,
+    "frame_loop": bench_frame_loop,
+    "frame_loop_dialog": bench_frame_loop_dialog,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # Print relative change per metric; returns the regressed metrics
+    regressions = []
+    for name, metrics in results["scenarios"].items():
+        old_metrics = baseline.get("scenarios", {}).get(name)
+        if not old_metrics:
+            continue
+        for key, value in metrics.items():
+            old = old_metrics.get(key)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if key in HIGHER_IS_BETTER else change
+            marker = ""
+            gated = key.endswith(GATED_SUFFIXES) or key in HIGHER_IS_BETTER
+            if gated and worse > threshold:
+                marker = "  REGRESSION"
+                regressions.append(f"{name}.{key}")
+            print(f"  {name}.{key}: {old} -> {value} ({change:+.1%}){marker}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adventure Game benchmarks")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help="scenarios to run (default: all): " + ", ".join(SCENARIOS))
+    parser.add_argument("--frames", type=int, default=600, help="frames per loop scenario")
+    parser.add_argument("--blocks", type=int, default=2000, help="solid tiles in the level")
+    parser.add_argument("--npcs", type=int, default=1, help="extra NPCs to spawn")
+    parser.add_argument("--size", type=int, default=1000, help="level_load map width/height in tiles")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recording", metavar="PATH", help="session replayed by the replay scenario")
+    parser.add_argument("--json", metavar="PATH", help="write machine-readable results")
+    parser.add_argument("--compare", metavar="PATH", help="compare against an earlier --json file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "params": {"frames": args.frames, "blocks": args.blocks, "npcs": args.npcs,
+                   "size": args.size, "seed": args.seed},
+        "scenarios": {},
+    }
+    for name in args.scenarios or SCENARIOS:
+        metrics = SCENARIOS[name](args)
+        results["scenarios"][name] = metrics
+        print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in metrics.items()))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (commit {baseline.get('commit')}):")
+        regressions = compare(results, baseline, args.threshold)
+
+    for failure in FAILURES:
+        print(f"FAILED {failure}")
+
+    pygame.quit()
+    sys.exit(1 if regressions or FAILURES else 0)
@@ -3,24 +3,111 @@ from pygame import mixer
 import random
 import sys 
 import os
-import traceback
 import math
-import random
-import asyncio
 import asyncio
+import argparse
+import time
+import struct
+import zlib
+import json
+import contextlib
+import hashlib
+import queue
+import atexit
+import logging
+import logging.handlers
+import sqlite3
+import heapq
+import threading
+import uuid
+from collections import OrderedDict, deque
+
+import numpy as np
 
 # Add more Streamlit components as needed
 
 
+# Headless mode (--headless or P5_HEADLESS=1): dummy video and audio drivers,
+# nothing is rendered and the simulation steps as fast as the CPU allows
+HEADLESS = "--headless" in sys.argv or os.environ.get("P5_HEADLESS") == "1"
+if HEADLESS:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# Dirty-rectangle rendering (--dirty-rects or P5_DIRTY_RECTS=1): only the
+# regions that changed are redrawn and pushed with display.update(rects)
+DIRTY_RECTS = "--dirty-rects" in sys.argv or os.environ.get("P5_DIRTY_RECTS") == "1"
+
+# Logging (level from --log-level or P5_LOG_LEVEL, default INFO). Records
+# below the level are dropped before they are built; the rest are rate
+# limited per message and handed to a queue, and a QueueListener thread does
+# the actual writes, so logging never blocks a frame on stdout.
+LOG_LEVEL = os.environ.get("P5_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+LOG_RATE_INTERVAL = 10.0  # seconds between two copies of the same message
+
+log = logging.getLogger("p5")
+
+
+# Lets each distinct message through at most once per interval. The next
+# copy that gets through reports how many were dropped in between, so a
+# warning hit every frame costs one line instead of 60 per second.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=LOG_RATE_INTERVAL, max_keys=1024):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self.seen = {}  # (logger, level, message) -> [last emitted, suppressed]
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.getMessage())
+        entry = self.seen.get(key)
+        if entry is not None and record.created - entry[0] < self.interval:
+            entry[1] += 1
+            return False
+        if entry is not None and entry[1]:
+            record.msg = f"{record.msg} [{entry[1]} similar suppressed]"
+        elif entry is None and len(self.seen) >= self.max_keys:
+            self.seen.clear()
+        self.seen[key] = [record.created, 0]
+        return True
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    log.setLevel(level)
+    if log.handlers:
+        return
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    sink = logging.handlers.QueueHandler(records)
+    sink.addFilter(RateLimitFilter())
+    log.addHandler(sink)
+    log.propagate = False
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)  # flushes whatever is still queued
+
+
+setup_logging()
+
 # Initialize Pygame and mixer
 pygame.init()
-mixer.init()
+try:
+    mixer.init()
+except pygame.error as e:
+    log.warning("Audio disabled: %s", e)
 
 # Constants
 WIDTH = 1200
 HEIGHT = 800
 FPS = 60
 
+# Fixed simulation step, and how many steps one frame may run to catch up
+# before the remaining time is dropped (frame-skip cap)
+SIM_DT = 1.0 / FPS
+MAX_SIM_STEPS = 5
+
 # Create window
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 pygame.display.set_caption("Adventure Game")
@@ -35,50 +122,502 @@ YELLOW = (255, 255, 0)
 PURPLE = (147, 0, 211)
 CYAN = (0, 255, 255)
 
-async def main():
-    global COUNT_DOWN
+# Audio
+BACKGROUND_MUSIC = 'assets/Skyfall x Attack on Titan.mp3'
+MUSIC_VOLUME = 0.5
+
+# Quiz answer feedback: total length and the flash/shake period in seconds
+FEEDBACK_DURATION = 0.5
+FEEDBACK_PERIOD = 0.05
+
+# The quiz dialog dims the world to this fraction per channel (same look as
+# the old black overlay at alpha 200)
+DIALOG_DIM = (55, 55, 55)
+
+# Size of one texture atlas page (pixels per side)
+ATLAS_PAGE_SIZE = 1024
+
+# Rendered text surfaces kept by the text cache (count and pixel memory)
+TEXT_CACHE_ENTRIES = 256
+TEXT_CACHE_BYTES = 8 * 1024 * 1024
+
+# Size in pixels of one level tile (and of one collision grid cell)
+TILE_SIZE = 32
+
+# Size in pixels of the baked terrain chunks, and how many baked chunks are
+# kept around before the least recently drawn ones are dropped
+TERRAIN_CHUNK_SIZE = 512
+MAX_TERRAIN_CHUNKS = 64
+
+# Camera: how quickly it catches up with the player (fraction per step) and
+# the cell size of the grid used to cull non-moving sprites
+CAMERA_LERP = 0.2
+SPRITE_CELL_SIZE = 256
+
+# Fastest fall speed of a dynamic body (pixels per step)
+TERMINAL_VELOCITY = 10
+
+# Level loaded by Game.create_level
+LEVEL_PATH = os.path.join("levels", "level1.p5map")
+
+# Quiz question bank (JSONL source, indexed into SQLite next to it) and how
+# many questions are kept decoded in memory
+QUESTION_BANK = os.path.join("questions", "bpjs.jsonl")
+QUESTION_CACHE_SIZE = 256
+
+# Quiz scheduling: questions asked before a Leitner box comes up again (a
+# question past the last box is mastered), and the smoothed accuracy at which
+# the player moves up or down a difficulty
+LEITNER_INTERVALS = (2, 4, 8, 16)
+LEVEL_UP_ACCURACY = 0.8
+LEVEL_DOWN_ACCURACY = 0.5
+LEVEL_MIN_ANSWERS = 3
+STATS_SMOOTHING = 0.3
+
+# Quiz event log (P5_QUIZ_LOG, empty to disable): a SQLite file written by a
+# background thread, at most QUIZ_LOG_BATCH events per transaction, at least
+# every QUIZ_LOG_FLUSH_INTERVAL seconds while events are coming in
+QUIZ_LOG_PATH = os.environ.get("P5_QUIZ_LOG", os.path.join("saves", "quiz.sqlite"))
+QUIZ_LOG_BATCH = 256
+QUIZ_LOG_FLUSH_INTERVAL = 0.5
+
+# Time from Game() to the first presented frame that we are willing to pay
+STARTUP_BUDGET_MS = 1000
+
+# Profiler: frames shown in the overlay graph, trace events kept for export
+# and the key that toggles the overlay
+PROFILER_FRAMES = 240
+PROFILER_EVENTS = 200000
+PROFILER_KEY = pygame.K_F3
+
+# Packs sprite frames and terrain tiles into a few large SRCALPHA pages using
+# shelf packing. Every frame handed out is a subsurface of its page: it shares
+# the page's pixels instead of owning a Surface of its own, and lookup() gives
+# the (page, area) pair for batched blits straight from the page.
+class TextureAtlas:
+    def __init__(self, page_size=ATLAS_PAGE_SIZE, padding=1):
+        self.page_size = page_size
+        self.padding = padding
+        self.pages = []
+        self.regions = {}  # key -> (page index, Rect)
+        self.frames = {}   # key -> subsurface of the page
+        self.shelf_x = self.shelf_y = self.shelf_height = 0
+        self.used_pixels = 0
+
+    def new_page(self):
+        self.pages.append(pygame.Surface((self.page_size, self.page_size), pygame.SRCALPHA))
+        self.shelf_x = self.shelf_y = self.shelf_height = 0
+
+    def place(self, width, height):
+        pad = self.padding
+        if not self.pages:
+            self.new_page()
+        if self.shelf_x + width > self.page_size:
+            # Start a new shelf below the current one
+            self.shelf_y += self.shelf_height + pad
+            self.shelf_x = self.shelf_height = 0
+        if self.shelf_y + height > self.page_size:
+            self.new_page()
+        rect = pygame.Rect(self.shelf_x, self.shelf_y, width, height)
+        self.shelf_x += width + pad
+        self.shelf_height = max(self.shelf_height, height)
+        return len(self.pages) - 1, rect
+
+    def add(self, key, surface):
+        if key in self.frames:
+            return self.frames[key]
+        width, height = surface.get_size()
+        if width > self.page_size or height > self.page_size:
+            return surface  # Too big to pack, keep it standalone
+
+        index, rect = self.place(width, height)
+        page = self.pages[index]
+        page.blit(surface, rect, special_flags=pygame.BLEND_RGBA_MAX)
+        frame = page.subsurface(rect)
+        self.regions[key] = (index, rect)
+        self.frames[key] = frame
+        self.used_pixels += width * height
+        return frame
+
+    def lookup(self, key):
+        index, rect = self.regions[key]
+        return self.pages[index], rect
+
+    def stats(self):
+        page_pixels = len(self.pages) * self.page_size * self.page_size
+        return {
+            "pages": len(self.pages),
+            "frames": len(self.frames),
+            "page_bytes": page_pixels * 4,
+            "fill": self.used_pixels / page_pixels if page_pixels else 0.0,
+        }
 
-    # avoid this kind declaration, prefer the way above
-    COUNT_DOWN = 3
+    def clear(self):
+        self.pages = []
+        self.regions.clear()
+        self.frames.clear()
+        self.shelf_x = self.shelf_y = self.shelf_height = 0
+        self.used_pixels = 0
 
-    while True:
-        
-        await asyncio.sleep(0)  # Very important, and keep it 0
 
-        if not COUNT_DOWN:
+# Process-wide asset registry. Every file is decoded once and the resulting
+# Surfaces are shared, keyed by (path, frame size, flip, scale), so building a
+# level with thousands of tiles only costs a handful of disk reads. Frames and
+# tiles are packed into the texture atlas.
+class AssetCache:
+    def __init__(self):
+        self.entries = {}
+        self.listings = {}
+        self.atlas = TextureAtlas()
+        self.hits = 0
+        self.misses = 0
+        self.decodes = 0
+
+    def _get(self, key, loader):
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        value = loader()
+        self.entries[key] = value
+        return value
+
+    def image(self, path):
+        def load():
+            self.decodes += 1
+            return pygame.image.load(path).convert_alpha()
+        return self._get(("image", path, None, False, 1), load)
+
+    def sound(self, path):
+        def load():
+            self.decodes += 1
+            return pygame.mixer.Sound(path)
+        return self._get(("sound", path, None, False, 1), load)
+
+    def font(self, path, size):
+        # Fonts are shared too, which also lets TEXT reuse renders across owners
+        return self._get(("font", path, size, False, 1), lambda: pygame.font.Font(path, size))
+
+    def frames(self, path, width, height, flip=False, scale=2):
+        key = ("frames", path, (width, height), flip, scale)
+
+        def load():
+            if flip:
+                # Mirror the already sliced frames instead of slicing again
+                return [self.atlas.add(key + (i,), pygame.transform.flip(sprite, True, False))
+                        for i, sprite in enumerate(self.frames(path, width, height, False, scale))]
+
+            sprite_sheet = self.image(path)
+            sprites = []
+            for i in range(sprite_sheet.get_width() // width):
+                surface = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+                rect = pygame.Rect(i * width, 0, width, height)
+                surface.blit(sprite_sheet, (0, 0), rect)
+                if scale == 2:
+                    surface = pygame.transform.scale2x(surface)
+                elif scale != 1:
+                    surface = pygame.transform.scale(surface, (width * scale, height * scale))
+                sprites.append(self.atlas.add(key + (i,), surface))
+            return sprites
+        return self._get(key, load)
+
+    def tile(self, path, area, size):
+        key = ("tile", path, tuple(area), False, size)
+
+        def load():
+            sprite_sheet = self.image(path)
+            return self.atlas.add(key, pygame.transform.scale(sprite_sheet.subsurface(area), (size, size)))
+        return self._get(key, load)
+
+    def listdir(self, path):
+        if path not in self.listings:
+            self.listings[path] = sorted(
+                f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))
+            )
+        return self.listings[path]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "decodes": self.decodes,
+            "entries": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "atlas_pages": len(self.atlas.pages),
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.listings.clear()
+        self.atlas.clear()
+        self.hits = self.misses = self.decodes = 0
+
+
+ASSETS = AssetCache()
+
+
+# Shared objects built on top of the assets, one per key: animation stores,
+# NPC types and question banks. Kept apart from ASSETS so its stats only
+# count asset lookups; clear() closes whatever holds an open handle.
+class Registry:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key, loader):
+        value = self.entries.get(key)
+        if value is None:
+            value = self.entries[key] = loader()
+        return value
+
+    def clear(self):
+        for value in self.entries.values():
+            close = getattr(value, "close", None)
+            if close is not None:
+                close()
+        self.entries.clear()
+
+
+REGISTRY = Registry()
+
+# LRU cache of rendered text keyed by (font, text, colour, antialias). HUD and
+# dialog strings rarely change between frames, so after the first frame they
+# cost a dict lookup instead of a Font.render. Entries and pixel memory are
+# both capped, so changing meme/quiz text can't grow the cache without bound.
+class TextCache:
+    def __init__(self, max_entries=TEXT_CACHE_ENTRIES, max_bytes=TEXT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), antialias)
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.entries[key] = surface
+        self.bytes += self.surface_bytes(surface)
+        while len(self.entries) > self.max_entries or (self.bytes > self.max_bytes and len(self.entries) > 1):
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= self.surface_bytes(evicted)
+            self.evictions += 1
+        return surface
+
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+
+TEXT = TextCache()
+
+# A timed animation. It holds no drawing code of its own: whoever draws reads
+# progress/phase each frame, so an effect never blocks the frame loop.
+class Tween:
+    def __init__(self, kind, duration, **data):
+        self.kind = kind
+        self.duration = duration
+        self.elapsed = 0.0
+        self.data = data
+
+    @property
+    def progress(self):
+        return min(1.0, self.elapsed / self.duration) if self.duration else 1.0
+
+    @property
+    def done(self):
+        return self.elapsed >= self.duration
+
+    def phase(self, period):
+        # Index of the current half-cycle of a period-long blink/shake
+        return int(self.elapsed / period)
+
+
+# Owns running tweens and advances them with the simulation clock
+class Animator:
+    def __init__(self):
+        self.tweens = []
+
+    def start(self, kind, duration, **data):
+        tween = Tween(kind, duration, **data)
+        self.tweens.append(tween)
+        return tween
+
+    def update(self, dt):
+        if not self.tweens:
+            return
+        for tween in self.tweens:
+            tween.elapsed += dt
+        self.tweens = [tween for tween in self.tweens if not tween.done]
+
+    def clear(self):
+        self.tweens = []
+
+# Owns the mixer music stream and the sound effects. Nothing else talks to
+# pygame.mixer directly, so building a level never does any audio I/O and the
+# background track is decoded and started exactly once.
+class AudioManager:
+    def __init__(self):
+        self.enabled = pygame.mixer.get_init() is not None
+        self.current_track = None
+        self.volume = MUSIC_VOLUME
+
+    def play_music(self, path, volume=None, loops=-1):
+        if volume is not None:
+            self.volume = volume
+        if not self.enabled:
+            return False
+        if self.current_track == path:
+            # Already streaming this track, don't reload or restart it
+            return True
+        try:
+            pygame.mixer.music.load(path)
+            pygame.mixer.music.set_volume(self.volume)
+            pygame.mixer.music.play(loops)
+            self.current_track = path
+            return True
+        except pygame.error as e:
+            log.warning("Could not load background music: %s", e)
+            return False
+
+    def stop_music(self):
+        if self.enabled and self.current_track:
+            pygame.mixer.music.stop()
+        self.current_track = None
+
+    def get_volume(self):
+        return self.volume
+
+    def set_volume(self, volume):
+        self.volume = max(0.0, min(1.0, volume))
+        if self.enabled:
+            pygame.mixer.music.set_volume(self.volume)
+
+    def toggle_music(self):
+        if not self.enabled:
             return
+        if pygame.mixer.music.get_busy():
+            pygame.mixer.music.pause()
+        else:
+            pygame.mixer.music.unpause()
+
+    def sound(self, path, volume=None):
+        # Sound effects are shared through the asset cache; a missing file
+        # gives None instead of aborting startup
+        if not self.enabled:
+            return None
+        try:
+            sound = ASSETS.sound(path)
+        except (pygame.error, FileNotFoundError) as e:
+            log.warning("Could not load sound %s: %s", path, e)
+            return None
+        if volume is not None:
+            sound.set_volume(volume)
+        return sound
+
+    def play(self, sound):
+        if sound is not None:
+            sound.play()
+
+# Animations of one sprite directory, decoded on first use. Listing the
+# directory is all construction costs; a sheet is sliced (through ASSETS)
+# the first time one of its animations is requested, and mirrored/scaled
+# variants are derived from the shared cache. Behaves like the dict that
+# load_sprite_sheets used to return: animation name -> list of frames.
+class AnimationStore:
+    def __init__(self, path, width, height, direction=False, scale=2):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.direction = direction
+        self.scale = scale
+        self.sheets = {image.replace(".png", ""): image for image in ASSETS.listdir(path)}
+        self.animations = {}  # name -> frames, filled lazily
+
+    def split(self, name):
+        # Animation name -> (sheet, flipped)
+        if not self.direction:
+            return name, False
+        if name.endswith("_right"):
+            return name[:-len("_right")], False
+        if name.endswith("_left"):
+            return name[:-len("_left")], True
+        return None, False
+
+    def keys(self):
+        if not self.direction:
+            return list(self.sheets)
+        return [sheet + side for sheet in self.sheets for side in ("_right", "_left")]
+
+    def __contains__(self, name):
+        sheet, _ = self.split(name)
+        return sheet in self.sheets
+
+    def __getitem__(self, name):
+        frames = self.animations.get(name)
+        if frames is None:
+            sheet, flip = self.split(name)
+            if sheet not in self.sheets:
+                raise KeyError(name)
+            frames = ASSETS.frames(os.path.join(self.path, self.sheets[sheet]),
+                                   self.width, self.height, flip, self.scale)
+            self.animations[name] = frames
+        return frames
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    async def warm(self, names=None):
+        # Decode the remaining animations in the background, one per frame
+        for name in names or self.keys():
+            if name not in self.animations:
+                self[name]
+                await asyncio.sleep(0)
+
 
 def load_sprite_sheets(dir1, width, height, direction=False):
     path = os.path.join("assets", dir1)
     
     if '/' in dir1:
         path = os.path.join("assets", *dir1.split('/'))
-    
-    images = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
 
-    all_sprites = {}
-
-    for image in images:
-        sprite_sheet = pygame.image.load(os.path.join(path, image)).convert_alpha()
-        
-        sprites = []
-        for i in range(sprite_sheet.get_width() // width):
-            surface = pygame.Surface((width, height), pygame.SRCALPHA, 32)
-            rect = pygame.Rect(i * width, 0, width, height)
-            surface.blit(sprite_sheet, (0, 0), rect)
-            sprites.append(pygame.transform.scale2x(surface))
-
-        if direction:
-            all_sprites[image.replace(".png", "") + "_right"] = sprites
-            all_sprites[image.replace(".png", "") + "_left"] = [
-                pygame.transform.flip(sprite, True, False) for sprite in sprites
-            ]
-        else:
-            all_sprites[image.replace(".png", "")] = sprites
-
-    return all_sprites
+    # One lazy store per sheet directory and layout, shared by every sprite
+    return REGISTRY.get(("animations", path, (width, height), direction),
+                        lambda: AnimationStore(path, width, height, direction))
 
 class Player(pygame.sprite.Sprite):
+    # Movement tuning, the same for every player
+    animation_delay = 3
+    acceleration = 0.5  # Percepatan
+    friction = 0.9  # Friction when no input
+    max_speed = 5  # Kecepatan maksimum
+    jump_power = -16
+    gravity = 0.5
+
     def __init__(self, game):
         super().__init__()
         self.game = game  # Store the game instance
@@ -86,86 +625,52 @@ class Player(pygame.sprite.Sprite):
         # Animation setup
         self.SPRITES = load_sprite_sheets("Mask Dude", 32, 32, True)
         self.animation_count = 0
-        self.animation_delay = 3
         self.current_sprite = 0
         
         # Basic setup
         self.image = self.SPRITES["idle_right"][0]
         self.rect = self.image.get_rect()
         
-        self.jump_sound = pygame.mixer.Sound('assets/Jump Sound Effect.mp3')
-        self.walk_sound = pygame.mixer.Sound('assets/Sound Effects - Footsteps.mp3')
-        self.walk_sound.set_volume(0.5)  # Adjust volume as needed
+        self.jump_sound = game.audio.sound('assets/Jump Sound Effect.mp3')
+        self.walk_sound = game.audio.sound('assets/Sound Effects - Footsteps.mp3', volume=0.5)  # Adjust volume as needed
         self.walk_sound_timer = 0
         
         # Position and movement
         self.rect.centerx = WIDTH // 2
         self.rect.bottom = HEIGHT - 100
+        self.prev_pos = self.rect.topleft  # Position before the last physics step
         
-        # Movement attributes
-        self.vel_x = 0
-        self.vel_y = 0
-        self.acceleration = 0.8
-        self.friction = 0.85
-        self.max_speed = 8
-        self.jump_power = -16
-        self.gravity = 0.5
-        self.ground_y = HEIGHT - 100
+        # Position and velocity live in the shared physics store
+        self.body = game.physics.add(self, self.rect, self.gravity, self.friction, self.max_speed)
         
         # State attributes
         self.jumping = False
         self.double_jump_available = True
         self.facing_right = True
-        
-        self.max_speed = 5  # Kecepatan maksimum
-        self.acceleration = 0.5  # Percepatan
-        
-        print("Available animations:", list(self.SPRITES.keys()))
 
-    def apply_movement(self):
-        # Apply gravity
-        self.vel_y += self.gravity
-        
-        # Apply friction
-        self.vel_x *= self.friction
-        
-        # Limit horizontal speed
-        self.vel_x = max(-self.max_speed, min(self.max_speed, self.vel_x))
+        # Quiz progress: answer statistics per question bank, and a
+        # scheduler per (bank, category) drawing on them
+        self.quiz_stats = {}
+        self.schedulers = {}
         
-        # Update position horizontally first
-        self.rect.x += int(self.vel_x)
-        self.handle_horizontal_collision()
-        # Check for horizontal collisions
-        blocks_hit = pygame.sprite.spritecollide(self, self.game.blocks, False)
-        for block in blocks_hit:
-            if self.vel_x > 0:  # Moving right
-                self.rect.right = min(WIDTH, self.rect.right)
-            elif self.vel_x < 0:  # Moving left
-                self.rect.left = max(0, self.rect.left)
-            self.vel_x = 0
-    
-        # Update position vertically
-        self.rect.y += int(self.vel_y)
-        self.handle_vertical_collision()
-        
-        # Check for vertical collisions
-        blocks_hit = pygame.sprite.spritecollide(self, self.game.blocks, False)
-        for block in blocks_hit:
-            if self.vel_y > 0:  # Moving down
-                self.rect.bottom = block.rect.top
-                self.vel_y = 0
-                self.jumping = False
-                self.double_jump_available = True
-            elif self.vel_y < 0:  # Moving up
-                self.rect.top = block.rect.bottom
-                self.vel_y = 0
-    
-        # Ground collision (optional, you might want to remove this if using only blocks)
-        if self.rect.bottom >= self.ground_y:
-            self.rect.bottom = self.ground_y
-            self.vel_y = 0
-            self.jumping = False
-            self.double_jump_available = True
+        log.debug("Available animations: %s", list(self.SPRITES.keys()))
+
+    @property
+    def vel_x(self):
+        return float(self.game.physics.vel[self.body, 0])
+
+    @vel_x.setter
+    def vel_x(self, value):
+        self.game.physics.vel[self.body, 0] = value
+
+    @property
+    def vel_y(self):
+        return float(self.game.physics.vel[self.body, 1])
+
+    @vel_y.setter
+    def vel_y(self, value):
+        self.game.physics.vel[self.body, 1] = value
+
     def update_sprite(self):
         try:
             sprite_sheet = "idle"
@@ -200,7 +705,7 @@ class Player(pygame.sprite.Sprite):
                 self.image = self.SPRITES["idle_right"][0]
                 
         except Exception as e:
-            print(f"Error in update_sprite: {e}")
+            log.error("Error in update_sprite: %s", e)
             # Fallback to first idle sprite
             self.image = self.SPRITES["idle_right"][0]
             self.current_sprite = 0
@@ -211,60 +716,60 @@ class Player(pygame.sprite.Sprite):
             if not self.jumping:
                 self.vel_y = self.jump_power
                 self.jumping = True
-                self.jump_sound.play()
+                self.game.audio.play(self.jump_sound)
             elif self.double_jump_available:
                 self.vel_y = self.jump_power
                 self.double_jump_available = False
-                print("Double jump executed")
-                self.jump_sound.play()
+                log.debug("Double jump executed")
+                self.game.audio.play(self.jump_sound)
         except Exception as e:
-            print(f"Error in jump method: {e}")
-            traceback.print_exc()
+            log.exception("Error in jump method: %s", e)
+
+    def apply_input(self):
+        # Input system: runs before the physics step
+        self.prev_pos = self.rect.topleft
 
-    def update(self):
         # Get joystick input
         joy_x, joy_y = self.game.joystick.get_value()
 
-        # Apply horizontal movement
+        # Apply horizontal movement (friction, speed limit, gravity and
+        # collision are applied to all bodies at once by PhysicsStore.step)
         if abs(joy_x) > 0.1:  # Dead zone
             self.vel_x += joy_x * self.acceleration
-        else:
-            self.vel_x *= 0.9  # Friction when no input
-
-        # Limit horizontal speed
-        self.vel_x = max(-self.max_speed, min(self.max_speed, self.vel_x))
+            self.game.physics.driven[self.body] = True
 
         # Update facing direction
-        if self.vel_x > 0:
+        vel_x = self.vel_x
+        if vel_x > 0:
             self.facing_right = True
-        elif self.vel_x < 0:
+        elif vel_x < 0:
             self.facing_right = False
-            
+
+    def after_physics(self):
+        # Physics system: react to the step that just ran
+        if self.game.physics.landed[self.body]:
+            self.jumping = False
+            self.double_jump_available = True
+
         if abs(self.vel_x) > 0.5 and not self.jumping:
             self.walk_sound_timer += 1
             if self.walk_sound_timer >= 20:  # Adjust this value to change the frequency of the sound
-                self.walk_sound.play()
+                self.game.audio.play(self.walk_sound)
                 self.walk_sound_timer = 0
         else:
             self.walk_sound_timer = 0
 
-        self.apply_gravity()
-        self.apply_movement()
-        self.update_sprite()
-        
-    def jump(self):
-        try:
-            if not self.jumping:
-                self.vel_y = self.jump_power
-                self.jumping = True
-                print("First jump executed")
-            elif self.double_jump_available:
-                self.vel_y = self.jump_power
-                self.double_jump_available = False
-                print("Double jump executed")
-        except Exception as e:
-            print(f"Error in jump method: {e}")
-            traceback.print_exc()
+    def quiz_scheduler(self, kind):
+        path = kind.question_path
+        key = (path, kind.category)
+        scheduler = self.schedulers.get(key)
+        if scheduler is None:
+            stats = self.quiz_stats.get(path)
+            if stats is None:
+                stats = self.quiz_stats[path] = QuizStats()
+            scheduler = self.schedulers[key] = QuestionScheduler(kind.questions, kind.category, stats,
+                                                                 self.game.rng)
+        return scheduler
 
     def move_left(self):
         self.vel_x -= self.acceleration
@@ -273,180 +778,806 @@ class Player(pygame.sprite.Sprite):
     def move_right(self):
         self.vel_x += self.acceleration
         self.facing_right = True
-        
-    def apply_gravity(self):
-        self.vel_y += self.gravity
-        if self.vel_y > 10:  # Terminal velocity
-            self.vel_y = 10
-    
-    def apply_movement(self):
-        # Update horizontal position
-        self.rect.x += int(self.vel_x)
-        self.handle_horizontal_collision()
-        
-        # Update vertical position
-        self.rect.y += int(self.vel_y)
-        self.handle_vertical_collision()
-    
-    def handle_horizontal_collision(self):
-        hits = pygame.sprite.spritecollide(self, self.game.blocks, False)
-        if hits:
-            if self.vel_x > 0:
-                self.rect.right = hits[0].rect.left
-            if self.vel_x < 0:
-                self.rect.left = hits[0].rect.right
-            self.vel_x = 0
-    
-    def handle_vertical_collision(self):
-        hits = pygame.sprite.spritecollide(self, self.game.blocks, False)
-        if hits:
-            if self.vel_y > 0:
-                self.rect.bottom = hits[0].rect.top
-                self.vel_y = 0
-                self.jumping = False
-                self.double_jump_available = True
-            if self.vel_y < 0:
-                self.rect.top = hits[0].rect.bottom
-                self.vel_y = 0
 
-class NPC(pygame.sprite.Sprite):
-    def __init__(self, x, y, name):
-        super().__init__()
-        self.SPRITES = load_sprite_sheets("Rock Head", 42, 42, True)
-        self.animation_count = 0
-        self.animation_delay = 5
-        self.current_sprite = 0
+# Quiz questions live in a JSONL file (one question per line: category,
+# difficulty, question, options, correct). The first time a bank is opened,
+# or after the JSONL changes, it is streamed into a SQLite index next to it,
+# sorted so each (category, difficulty) group is a contiguous id range. Rows
+# are then read one at a time through a small LRU cache, so memory does not
+# depend on the size of the bank. If the index cannot be written next to the
+# JSONL (read-only install), it is built in an in-memory database instead.
+class QuestionBank:
+    SCHEMA_VERSION = 1
+    BATCH = 1000
+    build_lock = threading.Lock()  # prepare() may run on a worker thread
+
+    def __init__(self, db_path, cache_size=QUESTION_CACHE_SIZE, db=None):
+        self.path = db_path
+        self.db = db if db is not None else sqlite3.connect(db_path)
+        self.cache = OrderedDict()  # id -> question dict
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        # (category, difficulty, first id, count), in id order
+        self.groups = self.db.execute(
+            "SELECT category, difficulty, first_id, count FROM groups ORDER BY first_id").fetchall()
+
+    @classmethod
+    def open(cls, path, cache_size=QUESTION_CACHE_SIZE):
+        if path.endswith(".jsonl"):
+            try:
+                path = cls.prepare(path)
+            except (OSError, sqlite3.Error) as e:
+                log.warning("Cannot write the question index for %s (%s); indexing it in memory",
+                            path, e)
+                db = sqlite3.connect(":memory:")
+                cls.build_into(db, path)
+                return cls(":memory:", cache_size, db)
+        return cls(path, cache_size)
+
+    @classmethod
+    def prepare(cls, source):
+        # Build or refresh the SQLite index of a JSONL bank; returns its path
+        db_path = os.path.splitext(source)[0] + ".sqlite"
+        with cls.build_lock:
+            if not cls.is_current(db_path, os.path.getmtime(source)):
+                cls.build(source, db_path)
+        return db_path
+
+    @classmethod
+    def is_current(cls, db_path, source_mtime):
+        if not os.path.exists(db_path) or os.path.getmtime(db_path) < source_mtime:
+            return False
         try:
-                # Load blink animation (adjust path as needed)
-            self.blink_sprites = load_sprite_sheets("Rock Head", 42, 42, False)
+            with contextlib.closing(sqlite3.connect(db_path)) as db:
+                return db.execute("PRAGMA user_version").fetchone()[0] == cls.SCHEMA_VERSION
+        except sqlite3.Error:
+            return False
+
+    @classmethod
+    def build(cls, source, db_path):
+        tmp_path = db_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with contextlib.closing(sqlite3.connect(tmp_path)) as db:
+            cls.build_into(db, source)
+            db.execute("VACUUM")
+        os.replace(tmp_path, db_path)
+        log.info("Built question index %s from %s", db_path, source)
+
+    @classmethod
+    def build_into(cls, db, source):
+        # Stream the JSONL into a staging table in batches, then copy it over
+        # sorted by group (SQLite sorts on disk, not in our memory)
+        db.executescript("""
+            CREATE TABLE staging (category TEXT, difficulty INTEGER, question TEXT,
+                                  options TEXT, correct INTEGER);
+            CREATE TABLE questions (id INTEGER PRIMARY KEY, category TEXT NOT NULL,
+                                    difficulty INTEGER NOT NULL, question TEXT NOT NULL,
+                                    options TEXT NOT NULL, correct INTEGER NOT NULL);
+            CREATE TABLE groups (category TEXT, difficulty INTEGER, first_id INTEGER, count INTEGER);
+        """)
+        batch = []
+        with open(source, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                    row = (str(item.get("category", "general")), int(item.get("difficulty", 1)),
+                           item["question"], json.dumps(item["options"], ensure_ascii=False),
+                           int(item["correct"]))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{source}:{line_no}: bad question: {e}") from None
+                batch.append(row)
+                if len(batch) >= cls.BATCH:
+                    db.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?)", batch)
+                    batch.clear()
+        db.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?)", batch)
+        db.executescript(f"""
+            INSERT INTO questions (category, difficulty, question, options, correct)
+                SELECT category, difficulty, question, options, correct FROM staging
+                ORDER BY category, difficulty, rowid;
+            DROP TABLE staging;
+            CREATE INDEX questions_category ON questions (category, difficulty);
+            CREATE INDEX questions_difficulty ON questions (difficulty);
+            INSERT INTO groups SELECT category, difficulty, MIN(id), COUNT(*)
+                FROM questions GROUP BY category, difficulty;
+            PRAGMA user_version = {cls.SCHEMA_VERSION};
+        """)
+        db.commit()
+
+    def __len__(self):
+        return sum(group[3] for group in self.groups)
+
+    def categories(self):
+        return sorted({group[0] for group in self.groups})
+
+    def ranges(self, category=None, difficulty=None):
+        # Contiguous (first id, count) ranges of the matching questions
+        return [(first, count) for group_category, group_difficulty, first, count in self.groups
+                if (category is None or group_category == category)
+                and (difficulty is None or group_difficulty == difficulty)]
+
+    def count(self, category=None, difficulty=None):
+        return sum(count for _, count in self.ranges(category, difficulty))
+
+    def get(self, question_id):
+        question = self.cache.get(question_id)
+        if question is not None:
+            self.hits += 1
+            self.cache.move_to_end(question_id)
+            return question
+        self.misses += 1
+        row = self.db.execute("SELECT id, category, difficulty, question, options, correct "
+                              "FROM questions WHERE id = ?", (question_id,)).fetchone()
+        if row is None:
+            raise KeyError(question_id)
+        question = {"id": row[0], "category": row[1], "difficulty": row[2], "question": row[3],
+                    "options": json.loads(row[4]), "correct": row[5]}
+        self.cache[question_id] = question
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return question
+
+    def deck(self, category=None, difficulty=None, rng=None):
+        return QuestionDeck(self.ranges(category, difficulty), rng)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"questions": len(self), "cached": len(self.cache), "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        self.db.close()
+
+
+# No-repeat random order over a set of question ids in O(1) memory: step k
+# of a round is k run through a keyed 8-round Feistel network over the next
+# power of four >= n, cycle-walked until it lands in 0..n-1 (a permutation
+# of 0..n-1), then mapped onto the id ranges. Without the round keys the
+# rest of a round can't be told from what was drawn so far. Every question
+# comes up once per round; a new round draws fresh keys, and if it would
+# open with the question just asked, its first two positions are swapped.
+class QuestionDeck:
+    ROUNDS = 8  # fewer rounds favour some orders on small decks
+
+    def __init__(self, ranges, rng=None):
+        self.ranges = ranges
+        self.size = sum(count for _, count in ranges)
+        self.rng = rng or random.Random()
+        self.position = 0  # questions drawn in the current round
+        self.last = None
+        self.swapped = False  # positions 0 and 1 of this round are swapped
+        self.shuffle()
+
+    def __len__(self):
+        return self.size
+
+    def shuffle(self):
+        self.position = 0
+        self.half = max(1, ((self.size - 1).bit_length() + 1) // 2)  # bits per Feistel half
+        self.keys = [self.rng.getrandbits(32) for _ in range(self.ROUNDS)]
+        self.swapped = self.size > 1 and self.id_at(self.index(0)) == self.last
+
+    def permute(self, x):
+        half = self.half
+        mask = (1 << half) - 1
+        left, right = x >> half, x & mask
+        for key in self.keys:
+            # Round function: a 32-bit integer hash of the right half and key
+            mixed = ((right ^ key) * 0x45D9F3B) & 0xFFFFFFFF
+            mixed = ((mixed ^ (mixed >> 16)) * 0x45D9F3B) & 0xFFFFFFFF
+            left, right = right, left ^ ((mixed ^ (mixed >> 16)) & mask)
+        return (left << half) | right
+
+    def index(self, position):
+        # Cycle-walk: the domain is < 4n, so a few steps on average
+        index = self.permute(position)
+        while index >= self.size:
+            index = self.permute(index)
+        return index
+
+    def id_at(self, index):
+        for first, count in self.ranges:
+            if index < count:
+                return first + index
+            index -= count
+        raise IndexError(index)
+
+    def next(self):
+        if not self.size:
+            raise IndexError("empty question deck")
+        if self.position >= self.size:
+            self.shuffle()
+        position = self.position
+        if self.swapped and position < 2:
+            position = 1 - position
+        question_id = self.id_at(self.index(position))
+        self.position += 1
+        self.last = question_id
+        return question_id
+
+
+# One question's answer history for one player
+class QuizCard:
+    __slots__ = ("question_id", "box", "due", "asked", "correct", "streak")
+
+    def __init__(self, question_id):
+        self.question_id = question_id
+        self.box = 0  # Leitner box; len(LEITNER_INTERVALS) = mastered
+        self.due = 0  # scheduler turn at which it comes up for review
+        self.asked = 0
+        self.correct = 0
+        self.streak = 0
+
+
+# Running totals for one (category, difficulty) group
+class QuizTotals:
+    __slots__ = ("asked", "correct", "timeouts", "seconds", "recent")
+
+    def __init__(self):
+        self.asked = 0
+        self.correct = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+        self.recent = None  # exponentially smoothed accuracy
+
+    def accuracy(self):
+        return self.correct / self.asked if self.asked else 0.0
+
+
+# Per-player answer statistics for one question bank. Updated incrementally
+# on every answer (one card per question, totals per group and a count per
+# Leitner box), so queries never scan the answer history.
+class QuizStats:
+    def __init__(self, boxes=len(LEITNER_INTERVALS), smoothing=STATS_SMOOTHING):
+        self.cards = {}  # question id -> QuizCard
+        self.groups = {}  # (category, difficulty) -> QuizTotals
+        self.boxes = [0] * (boxes + 1)  # cards per box, the last one is mastered
+        self.smoothing = smoothing
+
+    def __len__(self):
+        return len(self.cards)
+
+    def card(self, question_id):
+        card = self.cards.get(question_id)
+        if card is None:
+            card = self.cards[question_id] = QuizCard(question_id)
+            self.boxes[0] += 1
+        return card
+
+    def record(self, question, outcome, seconds=0.0):
+        # outcome is "correct", "wrong" or "timeout"
+        correct = outcome == "correct"
+        card = self.card(question["id"])
+        card.asked += 1
+        card.correct += correct
+        card.streak = card.streak + 1 if correct else 0
+
+        key = (question["category"], question["difficulty"])
+        totals = self.groups.get(key)
+        if totals is None:
+            totals = self.groups[key] = QuizTotals()
+        totals.asked += 1
+        totals.correct += correct
+        totals.timeouts += outcome == "timeout"
+        totals.seconds += seconds
+        if totals.recent is None:
+            totals.recent = float(correct)
+        else:
+            totals.recent += self.smoothing * (correct - totals.recent)
+        return card
+
+    def move(self, card, box):
+        self.boxes[card.box] -= 1
+        self.boxes[box] += 1
+        card.box = box
+
+    @property
+    def mastered(self):
+        return self.boxes[-1]
+
+    def group(self, category, difficulty):
+        return self.groups.get((category, difficulty))
+
+    def totals(self, category=None, difficulty=None):
+        totals = QuizTotals()
+        for (group_category, group_difficulty), group in self.groups.items():
+            if (category is None or group_category == category) and \
+                    (difficulty is None or group_difficulty == difficulty):
+                totals.asked += group.asked
+                totals.correct += group.correct
+                totals.timeouts += group.timeouts
+                totals.seconds += group.seconds
+        return totals
+
+    def accuracy(self, category=None, difficulty=None):
+        return self.totals(category, difficulty).accuracy()
+
+    def summary(self):
+        totals = self.totals()
+        return {"questions": len(self.cards), "answers": totals.asked,
+                "accuracy": totals.accuracy(), "timeouts": totals.timeouts,
+                "mastered": self.mastered, "boxes": list(self.boxes)}
+
+
+# Picks the questions one player is asked from one bank/category. Leitner
+# spaced repetition: a wrong answer (or timeout) puts the question back in
+# box 0, a right one moves it up a box; box b comes up again after
+# LEITNER_INTERVALS[b] questions. When nothing is due, an unseen question is
+# drawn at the player's difficulty level, which follows their smoothed
+# accuracy. The next question is picked ahead of time by prefetch(), between
+# frames, so answering only pops it off a queue.
+class QuestionScheduler:
+    def __init__(self, bank, category=None, stats=None, rng=None, intervals=LEITNER_INTERVALS):
+        self.bank = bank
+        self.category = category
+        self.stats = stats if stats is not None else QuizStats(len(intervals))
+        self.rng = rng or random.Random()
+        self.intervals = intervals
+        self.size = bank.count(category)
+        self.difficulties = sorted({difficulty for group_category, difficulty, _, _ in bank.groups
+                                    if category is None or group_category == category})
+        # One round of each deck is the order unseen questions are introduced in
+        self.new = [bank.deck(category, difficulty, self.rng) for difficulty in self.difficulties]
+        self.fallback = bank.deck(category, rng=self.rng)  # once everything is mastered
+        self.review = []  # heap of (due turn, question id)
+        self.upcoming = deque()  # questions already picked, asked next
+        self.level = 0  # index into difficulties
+        self.level_answers = 0  # answers at the current level since moving to it
+        self.turn = 0  # questions asked so far
+        self.current = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def mastered(self):
+        return self.stats.mastered
+
+    @property
+    def difficulty(self):
+        return self.difficulties[self.level] if self.difficulties else None
+
+    def next(self):
+        if not self.size:
+            raise IndexError("no questions to schedule")
+        self.turn += 1
+        self.current = self.upcoming.popleft() if self.upcoming else self.choose()
+        return self.current
+
+    def prefetch(self):
+        # Pick the question after the current one and load it into the
+        # bank's cache. Answering the current question cannot invalidate the
+        # pick: it is not due again for at least intervals[0] turns.
+        if not self.upcoming and self.size:
+            question_id = self.choose()
+            self.bank.get(question_id)
+            self.upcoming.append(question_id)
+
+    def choose(self):
+        # Due reviews first, then unseen questions, then the soonest review
+        turn = self.turn + 1
+        question_id = self.pop_review(turn)
+        if question_id is None:
+            question_id = self.draw_new()
+        if question_id is None:
+            question_id = self.pop_review()
+        if question_id is None:
+            question_id = self.fallback.next()
+            if question_id == self.current and self.size > 1:
+                question_id = self.fallback.next()
+        return question_id
+
+    def pop_review(self, turn=None):
+        # Soonest review (only if due by `turn`), never the question on screen
+        review = self.review
+        held = heapq.heappop(review) if review and review[0][1] == self.current else None
+        entry = None
+        if review and (turn is None or review[0][0] <= turn):
+            entry = heapq.heappop(review)
+        if held is not None:
+            heapq.heappush(review, held)
+        return entry[1] if entry is not None else None
+
+    def draw_new(self):
+        # Unseen questions at the player's level first, then the nearest levels
+        for i in sorted(range(len(self.new)), key=lambda i: (abs(i - self.level), i)):
+            deck = self.new[i]
+            if deck.position < len(deck):
+                return deck.next()
+        return None
+
+    def record(self, question, outcome, seconds=0.0):
+        stats = self.stats
+        card = stats.record(question, outcome, seconds)
+        mastered = len(self.intervals)
+        stats.move(card, min(card.box + 1, mastered) if outcome == "correct" else 0)
+        if card.box < mastered:
+            card.due = self.turn + self.intervals[card.box]
+            heapq.heappush(self.review, (card.due, card.question_id))
+        self.adjust_level(question)
+        return card
+
+    def adjust_level(self, question):
+        if question["difficulty"] != self.difficulty:
+            return
+        # Move only after LEVEL_MIN_ANSWERS answers at this level, in either
+        # direction, so one answer right after a move cannot undo it
+        self.level_answers += 1
+        if self.level_answers < LEVEL_MIN_ANSWERS:
+            return
+        totals = self.stats.group(question["category"], question["difficulty"])
+        level = self.level
+        if totals.recent >= LEVEL_UP_ACCURACY:
+            level = min(level + 1, len(self.difficulties) - 1)
+        elif totals.recent < LEVEL_DOWN_ACCURACY:
+            level = max(level - 1, 0)
+        if level != self.level:
+            self.level = level
+            self.level_answers = 0
+
+
+# Persistent record of quiz sessions and answers, for reporting. The game
+# only appends (statement, parameters) pairs to an in-memory queue; a writer
+# thread started on the first event owns the SQLite connection and commits
+# whatever has queued up as one transaction. The database is in WAL mode, so
+# a crash loses at most the last unflushed batch and never corrupts it.
+class QuizLog:
+    SCHEMA = """
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, started REAL NOT NULL,
+                                             ended REAL, answers INTEGER, correct INTEGER,
+                                             timeouts INTEGER);
+        CREATE TABLE IF NOT EXISTS events (session TEXT NOT NULL, time REAL NOT NULL,
+                                           kind TEXT NOT NULL, npc TEXT, question_id INTEGER,
+                                           category TEXT, difficulty INTEGER, outcome TEXT,
+                                           seconds REAL, score INTEGER, box INTEGER);
+        CREATE INDEX IF NOT EXISTS events_session ON events (session, time);
+    """
+    INSERT_EVENT = "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    WRITE_SLICE = 32
+    GATHER_DELAY = 0.01  # after the first event of a batch, let a burst queue up
+
+    def __init__(self, path=QUIZ_LOG_PATH, batch_size=QUIZ_LOG_BATCH,
+                 flush_interval=QUIZ_LOG_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.session = uuid.uuid4().hex
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.closed = False
+        self.answers = self.correct = self.timeouts = 0
+        # Written by the writer thread only
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path) and not self.closed
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="quiz-log", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        self.put("INSERT OR IGNORE INTO sessions (id, started) VALUES (?, ?)",
+                 (self.session, time.time()))
+
+    def put(self, sql, params):
+        if self.thread is None:
+            self.start()
+        self.queue.put((sql, params))
+
+    def event(self, kind, npc=None, question=None, outcome=None, seconds=None, score=None, box=None):
+        if not self.enabled:
+            return
+        if question is not None:
+            question_id, category, difficulty = question["id"], question["category"], question["difficulty"]
+        else:
+            question_id = category = difficulty = None
+        self.put(self.INSERT_EVENT, (self.session, time.time(), kind, npc, question_id, category,
+                                     difficulty, outcome, seconds, score, box))
+
+    def answer(self, npc, question, outcome, seconds, score, box):
+        self.answers += 1
+        self.correct += outcome == "correct"
+        self.timeouts += outcome == "timeout"
+        self.event("answer", npc, question, outcome, seconds, score, box)
+
+    def flush(self, timeout=None):
+        # Block until everything queued so far is committed (tests, exit)
+        if self.thread is None or not self.thread.is_alive():
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread is None:
+            return
+        self.queue.put(("UPDATE sessions SET ended = ?, answers = ?, correct = ?, timeouts = ? "
+                        "WHERE id = ?",
+                        (time.time(), self.answers, self.correct, self.timeouts, self.session)))
+        self.queue.put(None)
+        self.thread.join(timeout)
+        atexit.unregister(self.close)
+
+    def run(self):
+        # Writer thread: block for the first event of a batch, then collect
+        # more until the batch is full or flush_interval has passed
+        db = None
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path)
+            db.executescript(self.SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            log.error("Quiz log %s disabled: %s", self.path, e)
+            if db is not None:
+                db.close()
+            db = None
+        stopping = False
+        while not stopping:
+            batch = []
+            waiters = []
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            if isinstance(item, tuple):
+                time.sleep(self.GATHER_DELAY)
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stopping or waiters or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            self.write(db, batch)
+            for waiter in waiters:
+                waiter.set()
+        if db is not None:
+            db.close()
+
+    def write(self, db, batch):
+        if not batch:
+            return
+        if db is None:
+            self.dropped += len(batch)
+            return
+        try:
+            with db:  # one transaction per batch
+                # Runs of the same statement go through executemany, at most
+                # WRITE_SLICE rows per call; the thread yields the GIL between
+                # calls so the frame loop never waits long for it
+                start = 0
+                for end in range(1, len(batch) + 1):
+                    if end == len(batch) or batch[end][0] != batch[start][0] or \
+                            end - start >= self.WRITE_SLICE:
+                        db.executemany(batch[start][0], [params for _, params in batch[start:end]])
+                        start = end
+                        time.sleep(0)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.dropped += len(batch)
+            log.error("Could not write %d quiz events: %s", len(batch), e)
+
+    def stats(self):
+        return {"session": self.session, "queued": self.queue.qsize(), "written": self.written,
+                "batches": self.batches, "dropped": self.dropped}
+
+
+# Everything that is the same for all NPCs of one kind: sprites, quiz
+# questions, fonts, colours and dialog settings. Built once per name by
+# npc_type(); NPC instances only keep a reference to it.
+class NPCType:
+    def __init__(self, name, sheet_dir, question_path, category=None, size=42):
+        self.name = name
+        self.SPRITES = load_sprite_sheets(sheet_dir, size, size, True)
+        try:
+            # Load blink animation (adjust path as needed)
+            self.blink_sprites = load_sprite_sheets(sheet_dir, size, size, False)
             self.has_blink = True
         except Exception as e:
-            print(f"Could not load blink animation: {e}")
+            log.warning("Could not load blink animation: %s", e)
+            self.blink_sprites = {}
             self.has_blink = False
-        
-        self.animation_count = 0
+        self.size = size
         self.animation_delay = 5
-        self.current_sprite = 0
-        
-        # Blink animation settings
-        self.is_blinking = False
-        self.blink_timer = 0
-        self.blink_interval = random.randint(120, 240)  # Random interval between blinks
-        
-        # Make sure we start with a valid sprite
-        self.image = self.SPRITES["idle_right"][0] if "idle_right" in self.SPRITES else pygame.Surface((42, 42))
-        self.rect = self.image.get_rect()
-        self.rect.centerx = x
-        self.rect.centery = y
-        self.name = name
-        
-        # Quiz setup
-        self.questions = [
-            {
-                "question": "Apa kepanjangan dari BPJS?",
-                "options": [
-                    "A. Badan Penyelenggara Jaminan Sosial",
-                    "B. Badan Pelayanan Jaminan Sosial",
-                    "C. Badan Pemberi Jaminan Sosial",
-                    "D. Badan Penyedia Jaminan Sosial"
-                ],
-                "correct": 0  # Index of correct answer (A)
-            },
-            {
-                "question": "Berapa iuran BPJS Kesehatan kelas 3?",
-                "options": [
-                    "A. Rp35.000",
-                    "B. Rp42.000",
-                    "C. Rp50.000",
-                    "D. Rp45.000"
-                ],
-                "correct": 1  # Index of correct answer (B)
-            },
-            {
-                "question": "Apa yang TIDAK termasuk dalam layanan BPJS Kesehatan?",
-                "options": [
-                    "A. Rawat Inap",
-                    "B. Rawat Jalan",
-                    "C. Operasi Plastik Kecantikan",
-                    "D. Persalinan"
-                ],
-                "correct": 2  # Index of correct answer (C)
-            }
-        ]
-        
-        # Quiz state
-        self.current_question_index = 0
-        self.score = 0
-        self.answered_questions = set()
-        self.show_dialog = False
-        self.show_result = False
-        self.result_message = ""
-        self.result_timer = 0
-        
+        self.idle_sheet = "Idle_right"
+        self.blink_sheet = "Blink (42x42)"
+
+        # Quiz setup: a question bank file, asked from `category` (None = all).
+        # The bank is only opened (and indexed, if needed) when first used
+        self.question_path = question_path
+        self.category = category
+        self.question_timer = 15  # waktu dalam detik untuk setiap pertanyaan
+
         # Dialog box settings
         self.dialog_box_color = (50, 50, 50, 200)
         self.dialog_box_padding = 20
-        self.font = pygame.font.Font(None, 32)
-        
+
         # Interaction distance
         self.interaction_distance = 100
-        
-        self.dialog_alpha = 0
-        self.question_y = HEIGHT
-        self.options_x = [WIDTH] * 4
-        
+
         # Button settings
         self.button_color = (100, 100, 255)
         self.button_hover_color = (150, 150, 255)
         self.correct_color = (100, 255, 100)
         self.wrong_color = (255, 100, 100)
+
+        self.font = ASSETS.font(None, 32)
+        self.title_font = ASSETS.font(None, 48)
+        self.question_font = ASSETS.font(None, 36)
+        self.font_timer = ASSETS.font(None, 48)
+
+    @property
+    def questions(self):
+        return question_bank(self.question_path)
+
+
+# NPC name -> (sprite sheet directory, question bank, question category)
+NPC_TYPES = {
+    "Rock Head": ("Rock Head", QUESTION_BANK, "bpjs"),
+}
+
+
+def question_bank(path):
+    return REGISTRY.get(("questions", path), lambda: QuestionBank.open(path))
+
+
+def npc_type(name):
+    sheet_dir, bank_path, category = NPC_TYPES.get(name, NPC_TYPES["Rock Head"])
+    return REGISTRY.get(("npc_type", name),
+                        lambda: NPCType(name, sheet_dir, bank_path, category))
+
+
+# Per-NPC animation state. Slotted: no per-instance __dict__, so a crowd of
+# NPCs costs a few machine words each
+class AnimState:
+    __slots__ = ("animation_count", "current_sprite", "is_blinking", "blink_timer", "blink_interval")
+
+    def __init__(self, rng):
+        self.animation_count = 0
+        self.current_sprite = 0
+
+        # Blink animation settings
+        self.is_blinking = False
+        self.blink_timer = 0
+        self.blink_interval = rng.randint(120, 240)  # Random interval between blinks
+
+
+# Per-NPC quiz progress and dialog widgets. Only created once the player
+# opens that NPC's dialog
+class QuizState:
+    __slots__ = ("scheduler", "journal", "question_id", "score", "show_dialog",
+                 "show_result", "result_message", "result_timer", "timer_steps",
+                 "timer_running", "buttons", "back_button", "animator")
+
+    def __init__(self, scheduler, journal=None):
+        self.scheduler = scheduler  # the player's QuestionScheduler for this NPC's questions
+        self.journal = journal  # QuizLog the answers are persisted to, if any
+        self.question_id = scheduler.next()
+        self.score = 0
+        self.show_dialog = False
+        self.show_result = False
+        self.result_message = ""
+        self.result_timer = 0
+        self.timer_steps = 0  # simulation steps since the question was shown
+        self.timer_running = False
         self.buttons = []
-        
+
         # Add back button initialization here
         self.back_button = {
             'rect': pygame.Rect(WIDTH - 120, HEIGHT - 60, 100, 40),
             'text': 'Back',
             'hover': False
         }
-        
-        self.font = pygame.font.Font(None, 32)
-        self.title_font = pygame.font.Font(None, 48)
-        self.question_font = pygame.font.Font(None, 36)
 
+        # Non-blocking answer feedback, drawn by draw_dialog
+        self.animator = Animator()
+
+
+class NPC(pygame.sprite.Sprite):
+    def __init__(self, x, y, name, rng=random):
+        super().__init__()
+        self.type = npc_type(name)
+        # Blinks and question order. Game passes its seeded random.Random so
+        # sessions can be replayed; the default is the shared module generator
+        self.rng = rng
+        self.anim = AnimState(self.rng)
+        self.quiz = None  # QuizState, created when the dialog is first opened
+
+        # Make sure we start with a valid sprite
+        sprites = self.type.SPRITES
+        if self.type.idle_sheet in sprites:
+            self.image = sprites[self.type.idle_sheet][0]
+        else:
+            self.image = pygame.Surface((self.type.size, self.type.size))
+        self.rect = self.image.get_rect()
+        self.rect.centerx = x
+        self.rect.centery = y
+
+    @property
+    def name(self):
+        return self.type.name
+
+    @property
+    def SPRITES(self):
+        return self.type.SPRITES
+
+    @property
+    def show_dialog(self):
+        return self.quiz is not None and self.quiz.show_dialog
+
+    @show_dialog.setter
+    def show_dialog(self, value):
+        if value or self.quiz is not None:
+            self.get_quiz().show_dialog = value
+
+    def get_quiz(self, player=None):
+        if self.quiz is None:
+            if player is not None:
+                scheduler = player.quiz_scheduler(self.type)
+                journal = player.game.quiz_log
+            else:
+                scheduler = QuestionScheduler(self.type.questions, self.type.category, rng=self.rng)
+                journal = None
+            self.quiz = QuizState(scheduler, journal)
+            self.create_buttons()
+        return self.quiz
+
+    def open_dialog(self, player=None):
+        quiz = self.get_quiz(player)
+        if not quiz.show_dialog and quiz.journal is not None:
+            quiz.journal.event("open", self.name, score=quiz.score)
+        quiz.show_dialog = True
+
+    def close_dialog(self):
+        quiz = self.quiz
+        if quiz is not None:
+            if quiz.show_dialog and quiz.journal is not None:
+                quiz.journal.event("close", self.name, score=quiz.score)
+            quiz.show_dialog = False
+            quiz.show_result = False
 
-        self.question_timer = 15  # waktu dalam detik untuk setiap pertanyaan
-        self.timer_start = 0
-        self.timer_running = False
-        self.font_timer = pygame.font.Font(None, 48)
-        
-        self.create_buttons()
-        
     def handle_hover(self, pos):
         if self.show_dialog:
+            quiz = self.quiz
             # Update hover state untuk tombol back
-            self.back_button['hover'] = self.back_button['rect'].collidepoint(pos)
+            quiz.back_button['hover'] = quiz.back_button['rect'].collidepoint(pos)
 
             # Update hover state untuk tombol opsi
-            for button in self.buttons:
+            for button in quiz.buttons:
                 button['hover'] = button['rect'].collidepoint(pos)
 
     def create_buttons(self):
+        # The answer buttons' layout, used both for hit-testing and by
+        # draw_dialog, so clicks never depend on what was drawn
+        quiz = self.quiz
         try:
             # Pengaturan ukuran dan jarak
-            button_width = WIDTH * 0.6
-            button_height = 50
-            button_spacing = 30
+            button_width = WIDTH * 0.7
+            button_height = 60
+            button_spacing = 20
+            start_y = 250
             
-            current_q = self.questions[self.current_question_index]
+            current_q = self.type.questions.get(quiz.question_id)
             total_buttons = len(current_q['options'])
             
-            # Hitung total tinggi yang dibutuhkan untuk semua button
-            total_height = (button_height * total_buttons) + (button_spacing * (total_buttons - 1))
-            
-            # Hitung posisi Y awal
-            start_y = (HEIGHT - total_height) // 2 + 50
-            
-            self.buttons = []
+            quiz.buttons = []
             
             # Buat button hanya untuk jumlah opsi yang tersedia
             for i in range(total_buttons):
@@ -454,146 +1585,149 @@ class NPC(pygame.sprite.Sprite):
                 y = start_y + (i * (button_height + button_spacing))
                 
                 button_rect = pygame.Rect(x, y, button_width, button_height)
-                self.buttons.append({
+                quiz.buttons.append({
                     'rect': button_rect,
                     'index': i,
                     'hover': False
                 })
         except Exception as e:
-            print(f"Error in create_buttons: {e}")
-            self.buttons = []  # Reset buttons jika terjadi error
+            log.error("Error in create_buttons: %s", e)
+            quiz.buttons = []  # Reset buttons jika terjadi error
     
+    def remaining_time(self):
+        elapsed_time = self.quiz.timer_steps // FPS
+        return max(0, self.type.question_timer - elapsed_time)
+
+    def dialog_state(self):
+        # Everything draw_dialog depends on; the dialog layer recomposes
+        # only when this changes
+        quiz = self.quiz
+        return (quiz.question_id, quiz.scheduler.turn, quiz.score, quiz.back_button['hover'],
+                tuple(button['hover'] for button in quiz.buttons),
+                self.remaining_time() if quiz.timer_running else None,
+                quiz.result_message if quiz.show_result and quiz.result_timer > 0 else None)
+
     def draw_dialog(self, screen):
+        # Static dialog chrome, drawn by DialogLayer over the dimmed world;
+        # the answer feedback is drawn on top of it every frame
         if self.show_dialog:
+            quiz = self.quiz
+            kind = self.type
             try:
-                # Background semi-transparan
-                dialog_surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-                pygame.draw.rect(dialog_surface, (0, 0, 0, 200), dialog_surface.get_rect())
-                screen.blit(dialog_surface, (0, 0))
-
                 # Judul Quiz
                 title_text = "BPJS Quiz"
-                title_surface = self.title_font.render(title_text, True, WHITE)
+                title_surface = TEXT.render(kind.title_font, title_text, WHITE)
                 title_rect = title_surface.get_rect(centerx=WIDTH//2, top=50)
                 screen.blit(title_surface, title_rect)
                 
                 back_button_rect = pygame.Rect(20, 20, 150, 40)  # Position in top-left corner
-                back_color = (100, 100, 255) if self.back_button['hover'] else (70, 70, 200)
+                back_color = (100, 100, 255) if quiz.back_button['hover'] else (70, 70, 200)
                 pygame.draw.rect(screen, back_color, back_button_rect, border_radius=5)
             
 
                 # Timer display
-                if self.timer_running:
-                    current_time = pygame.time.get_ticks()
-                    elapsed_time = (current_time - self.timer_start) // 1000
-                    remaining_time = max(0, self.question_timer - elapsed_time)
-
-                    # Jika waktu habis, pindah ke pertanyaan berikutnya
-                    if remaining_time == 0:
-                        self.result_message = "Time's up!"
-                        self.show_result = True
-                        self.result_timer = 60
-                        self.move_to_random_question()
-                        return
-
-                    # Tampilkan timer
+                if quiz.timer_running:
+                    remaining_time = self.remaining_time()
+
+                    # Tampilkan timer (update_dialog pindah ke pertanyaan berikutnya)
                     timer_text = f"Time: {remaining_time}"
                     timer_color = RED if remaining_time <= 5 else WHITE
-                    timer_surface = self.font_timer.render(timer_text, True, timer_color)
+                    timer_surface = TEXT.render(kind.font_timer, timer_text, timer_color)
                     timer_rect = timer_surface.get_rect(centerx=WIDTH//2, top=10)
                     screen.blit(timer_surface, timer_rect)
 
                 # Score dan nomor pertanyaan
-                score_text = f"Score: {self.score}"
-                score_surface = self.font.render(score_text, True, WHITE)
+                score_text = f"Score: {quiz.score}"
+                score_surface = TEXT.render(kind.font, score_text, WHITE)
                 screen.blit(score_surface, (20, 20))
 
-                question_num_text = f"Question {self.current_question_index + 1}/{len(self.questions)}"
-                question_num_surface = self.font.render(question_num_text, True, WHITE)
+                scheduler = quiz.scheduler
+                question_num_text = f"Question {scheduler.turn}  Mastered {scheduler.mastered}/{len(scheduler)}"
+                question_num_surface = TEXT.render(kind.font, question_num_text, WHITE)
                 screen.blit(question_num_surface, (WIDTH - question_num_surface.get_width() - 20, 20))
 
                 # Pertanyaan
-                current_q = self.questions[self.current_question_index]
-                question_surface = self.question_font.render(current_q['question'], True, WHITE)
+                current_q = kind.questions.get(quiz.question_id)
+                question_surface = TEXT.render(kind.question_font, current_q['question'], WHITE)
                 question_rect = question_surface.get_rect(centerx=WIDTH//2, top=150)
                 screen.blit(question_surface, question_rect)
 
-                # Opsi jawaban
+                # Opsi jawaban, at the rects laid out by create_buttons
                 options = current_q['options']
-                button_width = WIDTH * 0.7
-                button_height = 60
-                button_spacing = 20
-                start_y = 250
-
-                for i, (button, option) in enumerate(zip(self.buttons, options)):
-                    button_rect = pygame.Rect((WIDTH - button_width) // 2,
-                                            start_y + i * (button_height + button_spacing),
-                                            button_width, button_height)
-                    button['rect'] = button_rect  # Update button rect
+                for button, option in zip(quiz.buttons, options):
+                    button_rect = button['rect']
 
                     # Warna button
-                    color = self.button_hover_color if button['hover'] else self.button_color
+                    color = kind.button_hover_color if button['hover'] else kind.button_color
                     pygame.draw.rect(screen, color, button_rect, border_radius=10)
 
                     # Teks opsi
-                    text_surface = self.font.render(option, True, WHITE)
+                    text_surface = TEXT.render(kind.font, option, WHITE)
                     text_rect = text_surface.get_rect(center=button_rect.center)
                     screen.blit(text_surface, text_rect)
 
                 # Pesan hasil jika ada
-                if self.show_result and self.result_timer > 0:
-                    result_surface = self.font.render(self.result_message, True, WHITE)
+                if quiz.show_result and quiz.result_timer > 0:
+                    result_surface = TEXT.render(kind.font, quiz.result_message, WHITE)
                     result_rect = result_surface.get_rect(centerx=WIDTH//2, bottom=HEIGHT-20)
                     screen.blit(result_surface, result_rect)
 
                 # Tombol back di pojok kanan bawah
                 pygame.draw.rect(screen,
-                               self.button_hover_color if self.back_button['hover'] else self.button_color,
-                               self.back_button['rect'],
+                               kind.button_hover_color if quiz.back_button['hover'] else kind.button_color,
+                               quiz.back_button['rect'],
                                border_radius=5)
-                back_text_surface = self.font.render(self.back_button['text'], True, WHITE)
-                back_text = self.font.render("Back to Game", True, WHITE)
+                back_text = TEXT.render(kind.font, "Back to Game", WHITE)
                 back_text_rect = back_text.get_rect(center=back_button_rect.center)
                 screen.blit(back_text, back_text_rect)
 
             except Exception as e:
-                print(f"Error in draw_dialog: {e}")
+                log.error("Error in draw_dialog: %s", e)
     def handle_click(self, pos):
         if self.show_dialog:
+            quiz = self.quiz
             # Check for back button click
-            if self.back_button['rect'].collidepoint(pos):
-                self.show_dialog = False
-                self.show_result = False
-                self.timer_running = False
+            if quiz.back_button['rect'].collidepoint(pos):
+                self.close_dialog()
+                quiz.timer_running = False
                 return True
 
-            current_q = self.questions[self.current_question_index]
+            current_q = self.type.questions.get(quiz.question_id)
 
-            for button in self.buttons:
+            for button in quiz.buttons:
                 if button['rect'].collidepoint(pos):
                     if button['index'] == current_q['correct']:
-                        self.score += 1
-                        self.result_message = "Correct!"
+                        quiz.score += 1
+                        quiz.result_message = "Correct!"
                         self.show_correct_animation(button['rect'])
+                        self.record_answer(current_q, "correct")
                     else:
-                        self.result_message = "Wrong! The correct answer was: " + current_q['options'][current_q['correct']]
+                        quiz.result_message = "Wrong! The correct answer was: " + current_q['options'][current_q['correct']]
                         self.show_wrong_animation(button['rect'])
+                        self.record_answer(current_q, "wrong")
 
-                    self.show_result = True
-                    self.result_timer = 60
-                    self.timer_running = False
+                    quiz.show_result = True
+                    quiz.result_timer = 60
+                    quiz.timer_running = False
                     self.move_to_random_question()
                     return True
         return False
 
+    def record_answer(self, question, outcome):
+        quiz = self.quiz
+        seconds = quiz.timer_steps * SIM_DT if quiz.timer_running else 0.0
+        card = quiz.scheduler.record(question, outcome, seconds)
+        if quiz.journal is not None:
+            # Queued only; the QuizLog writer thread does the disk I/O
+            quiz.journal.answer(self.name, question, outcome, seconds, quiz.score, card.box)
+
     def move_to_random_question(self):
-        available_questions = [i for i in range(len(self.questions)) 
-                             if i != self.current_question_index]
-        if available_questions:
-            self.current_question_index = random.choice(available_questions)
-            # Reset timer untuk pertanyaan baru
-            self.timer_start = pygame.time.get_ticks()
-            self.timer_running = True
+        # Next question from the scheduler, picked ahead of time by prefetch()
+        quiz = self.quiz
+        quiz.question_id = quiz.scheduler.next()
+        # Reset timer untuk pertanyaan baru
+        quiz.timer_steps = 0
+        quiz.timer_running = True
         self.create_buttons()
 
     def can_interact(self, player):
@@ -601,174 +1735,481 @@ class NPC(pygame.sprite.Sprite):
         dx = self.rect.centerx - player.rect.centerx
         dy = self.rect.centery - player.rect.centery
         distance = (dx ** 2 + dy ** 2) ** 0.5
-        return distance <= self.interaction_distance
+        return distance <= self.type.interaction_distance
 
     def update_sprite(self):
-        try:
-            if self.has_blink and self.is_blinking:
-                # Play blink animation
-                sprite_sheet = "Blink"
-                if sprite_sheet in self.blink_sprites:
-                    sprites = self.blink_sprites[sprite_sheet]
-                    if len(sprites) > 0:
-                        if self.animation_count >= self.animation_delay:
-                            self.current_sprite = (self.current_sprite + 1) % len(sprites)
-                            self.animation_count = 0
-                            
-                            # Check if blink animation is complete
-                            if self.current_sprite == 0:
-                                self.is_blinking = False
-                                self.blink_timer = 0
-                        
-                        self.image = sprites[self.current_sprite]
-                        self.animation_count += 1
-            else:
-                # Normal idle animation
-                sprite_sheet = "idle_right"
-                if sprite_sheet in self.SPRITES:
-                    sprites = self.SPRITES[sprite_sheet]
-                    if len(sprites) > 0:
-                        if self.animation_count >= self.animation_delay:
-                            self.current_sprite = (self.current_sprite + 1) % len(sprites)
-                            self.animation_count = 0
-                        
-                        self.image = sprites[self.current_sprite]
-                        self.animation_count += 1
-                else:
-                    print(f"Warning: '{sprite_sheet}' animation not found in sprites")
-        except Exception as e:
-            print(f"Error in update_sprite: {e}")
-
+        # Animation system: idle loop with a blink every few seconds
+        anim = self.anim
+        kind = self.type
+        if not anim.is_blinking:
+            anim.blink_timer += 1
+            if kind.has_blink and anim.blink_timer >= anim.blink_interval:
+                anim.is_blinking = True
+                anim.current_sprite = 0
+                anim.animation_count = 0
+                anim.blink_interval = self.rng.randint(120, 240)  # Set new random interval
+
+        sprites = None
+        if anim.is_blinking:
+            sprites = kind.blink_sprites.get(kind.blink_sheet)
+            if not sprites:
+                anim.is_blinking = False
+        if not anim.is_blinking:
+            sprites = kind.SPRITES.get(kind.idle_sheet)
+        if not sprites:
+            log.warning("Animation %r not found in %s sprites", kind.idle_sheet, kind.name)
+            return
 
-    def update(self):
-        
-        self.update_sprite()
+        if anim.animation_count >= kind.animation_delay:
+            anim.current_sprite = (anim.current_sprite + 1) % len(sprites)
+            anim.animation_count = 0
+            # Back to idle once the blink has played through
+            if anim.is_blinking and anim.current_sprite == 0:
+                anim.is_blinking = False
+                anim.blink_timer = 0
+        self.image = sprites[anim.current_sprite % len(sprites)]
+        anim.animation_count += 1
+
+    def update_dialog(self):
+        # Dialog system: result message, question timer and answer feedback
+        quiz = self.quiz
+        if quiz is None:
+            return
 
         # Update result timer
-        if self.result_timer > 0:
-            self.result_timer -= 1
-            if self.result_timer == 0:
-                self.show_result = False
+        if quiz.result_timer > 0:
+            quiz.result_timer -= 1
+            if quiz.result_timer == 0:
+                quiz.show_result = False
+
+        # The question timer runs on simulation time, so replays time out
+        # on the same step
+        if quiz.timer_running:
+            quiz.timer_steps += 1
 
         # Check timer jika dialog sedang aktif
-        if self.show_dialog and self.timer_running:
-            current_time = pygame.time.get_ticks()
-            elapsed_time = (current_time - self.timer_start) // 1000
-            if elapsed_time >= self.question_timer:
-                self.result_message = "Time's up!"
-                self.show_result = True
-                self.result_timer = 60
-                self.timer_running = False
+        if quiz.show_dialog and quiz.timer_running:
+            if self.remaining_time() == 0:
+                self.record_answer(self.type.questions.get(quiz.question_id), "timeout")
+                quiz.result_message = "Time's up!"
+                quiz.show_result = True
+                quiz.result_timer = 60
+                quiz.timer_running = False
                 self.move_to_random_question()
-                
-        if not self.is_blinking:
-            self.blink_timer += 1
-            if self.blink_timer >= self.blink_interval:
-                self.is_blinking = True
-                self.current_sprite = 0
-                self.animation_count = 0
-                self.blink_interval = random.randint(120, 240)  # Set new random interval
-            
-            self.update_sprite()
-            
-        if self.has_blink and not self.is_blinking:
-            self.blink_timer += 1
-            if self.blink_timer >= self.blink_interval:
-                self.is_blinking = True
-                self.current_sprite = 0
-                self.animation_count = 0
-                self.blink_interval = random.randint(120, 240)  # Set new random interval
-    
-    def create_buttons(self):
-        current_q = self.questions[self.current_question_index]
-        for i, option in enumerate(current_q['options']):
-            rect = pygame.Rect(100 + (i % 2) * 300, 250 + (i // 2) * 50, 250, 40)
-            self.buttons.append({'rect': rect, 'index': i, 'hover': False})
 
-    def update_sprite(self):
-        sprite_sheet_name = "Idle_right"  # Default animation
-        
-        if "Idle_right" in self.SPRITES:
-            sprites = self.SPRITES["Idle_right"]
-            
-            if self.animation_count >= self.animation_delay:
-                self.current_sprite = (self.current_sprite + 1) % len(sprites)
-                self.animation_count = 0
+        # Pick the next question now, not when the player answers
+        if quiz.show_dialog:
+            quiz.scheduler.prefetch()
 
-            self.image = sprites[self.current_sprite]
-            self.animation_count += 1
-        else:
-            print("Warning: 'Idle_right' animation not found in sprites")
+        quiz.animator.update(SIM_DT)
     
     def show_correct_animation(self, rect):
-        # Implementasikan animasi jawaban benar di sini
-        # Misalnya, buat efek kilat hijau
-        for _ in range(5):
-            pygame.draw.rect(screen, GREEN, rect, border_radius=10)
-            pygame.display.flip()
-            pygame.time.wait(50)
-            pygame.draw.rect(screen, self.button_color, rect, border_radius=10)
-            pygame.display.flip()
-            pygame.time.wait(50)
+        # Kilat hijau pada tombol jawaban, digambar oleh draw_dialog
+        self.quiz.animator.start("correct", FEEDBACK_DURATION, rect=rect.copy())
 
     def show_wrong_animation(self, rect):
-        # Implementasikan animasi jawaban salah di sini
-        # Misalnya, buat efek getaran
-        original_x = rect.x
-        for _ in range(5):
-            rect.x = original_x - 5
-            pygame.draw.rect(screen, RED, rect, border_radius=10)
-            pygame.display.flip()
-            pygame.time.wait(50)
-            rect.x = original_x + 5
-            pygame.draw.rect(screen, RED, rect, border_radius=10)
-            pygame.display.flip()
-            pygame.time.wait(50)
-        rect.x = original_x
-        
-    def update(self):
-        self.update_sprite()
-class Block(pygame.sprite.Sprite):
-    def __init__(self, x, y, terrain_type, size=32):
-        super().__init__()
-        try:
-            # Load the terrain sprite sheet
-            sprite_sheet = pygame.image.load(os.path.join("assets", "Terrain (16x16).png")).convert_alpha()
-            
-            # Define the positions of different terrain types in the sprite sheet
-            terrain_positions = {
-                "grass": (0, 0),
-                "dirt": (0, 16),
-                "stone": (0, 32),
-                # Add more terrain types as needed
-            }
-            
-            # Get the position of the desired terrain type
-            sheet_x, sheet_y = terrain_positions.get(terrain_type, (0, 0))
-            
-            # Create a surface for our block
-            self.image = pygame.Surface((size, size), pygame.SRCALPHA)
-            
-            # Scale and draw the terrain texture onto our block
-            terrain_surface = sprite_sheet.subsurface((sheet_x, sheet_y, 16, 16))
-            scaled_terrain = pygame.transform.scale(terrain_surface, (size, size))
-            self.image.blit(scaled_terrain, (0, 0))
-            
-            pygame.mixer.music.load('assets/Skyfall x Attack on Titan.mp3')  # Make sure to have this file
-            pygame.mixer.music.set_volume(0.5)  # Set volume to 50%
-            pygame.mixer.music.play(-1)  # -1 means loop indefinitely
-            
-        except pygame.error as e:
-            print(f"Error loading sprite: {e}")
-            self.image = pygame.Surface((size, size))
-            self.image.fill((100, 100, 100))  # Gray color for missing texture
-            print("Could not load background music")
-        
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-        
-        
+        # Efek getaran merah pada tombol jawaban, digambar oleh draw_dialog
+        self.quiz.animator.start("wrong", FEEDBACK_DURATION, rect=rect.copy())
+
+    def draw_feedback(self, screen):
+        for tween in self.quiz.animator.tweens:
+            rect = tween.data["rect"]
+            phase = tween.phase(FEEDBACK_PERIOD)
+            if tween.kind == "correct":
+                color = GREEN if phase % 2 == 0 else self.type.button_color
+                pygame.draw.rect(screen, color, rect, border_radius=10)
+            elif tween.kind == "wrong":
+                offset = -5 if phase % 2 == 0 else 5
+                pygame.draw.rect(screen, RED, rect.move(offset, 0), border_radius=10)
+
+# Terrain sprite sheet and the position of each terrain type inside it
+TERRAIN_SHEET = os.path.join("assets", "Terrain (16x16).png")
+TERRAIN_POSITIONS = {
+    "grass": (0, 0),
+    "dirt": (0, 16),
+    "stone": (0, 32),
+    # Add more terrain types as needed
+}
+
+# Uniform grid index over non-moving sprites. Every sprite is stored in each
+# cell its rect overlaps, so a query only looks at the handful of cells
+# around a rect instead of scanning every sprite in the level.
+class SpatialGrid:
+    def __init__(self, cell_size=TILE_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> sprites overlapping that cell
+
+    def cell_keys(self, rect):
+        size = self.cell_size
+        for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                yield (cx, cy)
+
+    def insert(self, sprite):
+        for key in self.cell_keys(sprite.rect):
+            self.cells.setdefault(key, []).append(sprite)
+
+    def query(self, rect):
+        # Candidate sprites near rect (no overlap test, no duplicates)
+        found = []
+        seen = set()
+        cells = self.cells
+        for key in self.cell_keys(rect):
+            for sprite in cells.get(key, ()):
+                if sprite not in seen:
+                    seen.add(sprite)
+                    found.append(sprite)
+        return found
+
+# Level geometry stored as one byte per tile (row-major, 0 = empty, n = the
+# n-th terrain type of the palette). There is no Python object per tile:
+# collision and terrain baking read the byte grid directly.
+#
+# On disk (.p5map): a little-endian header (magic, version, tile size, width,
+# height, palette size), the palette as length-prefixed UTF-8 names, then the
+# zlib-compressed tile grid which is streamed into place when loading.
+class TileMap:
+    MAGIC = b"P5MP"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBHIIB")
+    READ_CHUNK = 64 * 1024
+
+    def __init__(self, width, height, palette=(), tile_size=TILE_SIZE, tiles=None):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.palette = list(palette)
+        self.tiles = tiles if tiles is not None else bytearray(width * height)
+
+    @property
+    def pixel_width(self):
+        return self.width * self.tile_size
+
+    @property
+    def pixel_height(self):
+        return self.height * self.tile_size
+
+    def terrain_id(self, terrain_type):
+        if terrain_type is None:
+            return 0
+        if terrain_type not in self.palette:
+            if len(self.palette) >= 255:
+                raise ValueError("TileMap palette is full")
+            self.palette.append(terrain_type)
+        return self.palette.index(terrain_type) + 1
+
+    def get(self, tx, ty):
+        if 0 <= tx < self.width and 0 <= ty < self.height:
+            return self.tiles[ty * self.width + tx]
+        return 0
+
+    def set(self, tx, ty, terrain_type):
+        self.tiles[ty * self.width + tx] = self.terrain_id(terrain_type)
+
+    def fill(self, tx, ty, width, height, terrain_type):
+        # Fill a block of tiles, one slice assignment per row
+        tile_id = self.terrain_id(terrain_type)
+        x0, x1 = max(0, tx), min(self.width, tx + width)
+        if x0 >= x1:
+            return
+        row = bytes([tile_id]) * (x1 - x0)
+        for y in range(max(0, ty), min(self.height, ty + height)):
+            start = y * self.width
+            self.tiles[start + x0:start + x1] = row
+
+    def solid_count(self):
+        return len(self.tiles) - self.tiles.count(0)
+
+    def tile_range(self, rect):
+        size = self.tile_size
+        return (max(0, rect.left // size), min(self.width, (rect.right - 1) // size + 1),
+                max(0, rect.top // size), min(self.height, (rect.bottom - 1) // size + 1))
+
+    def collide(self, rect):
+        # Rects of the solid tiles overlapping rect
+        x0, x1, y0, y1 = self.tile_range(rect)
+        size = self.tile_size
+        tiles = self.tiles
+        hits = []
+        for ty in range(y0, y1):
+            row = ty * self.width
+            for tx in range(x0, x1):
+                if tiles[row + tx]:
+                    hits.append(pygame.Rect(tx * size, ty * size, size, size))
+        return hits
+
+    def images(self):
+        # Surface per tile id (index 0 is empty)
+        images = [None]
+        for terrain_type in self.palette:
+            sheet_x, sheet_y = TERRAIN_POSITIONS.get(terrain_type, (0, 0))
+            images.append(ASSETS.tile(TERRAIN_SHEET, (sheet_x, sheet_y, 16, 16), self.tile_size))
+        return images
+
+    def save(self, path):
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.tile_size,
+                                  self.width, self.height, len(self.palette))
+        with open(path, "wb") as f:
+            f.write(header)
+            for terrain_type in self.palette:
+                name = terrain_type.encode("utf-8")
+                f.write(bytes([len(name)]) + name)
+            f.write(zlib.compress(bytes(self.tiles), 6))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, version, tile_size, width, height, palette_size = cls.HEADER.unpack(
+                f.read(cls.HEADER.size))
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError(f"{path} is not a version {cls.VERSION} level file")
+            palette = []
+            for _ in range(palette_size):
+                length = f.read(1)[0]
+                palette.append(f.read(length).decode("utf-8"))
+
+            # Stream the compressed grid straight into a preallocated buffer
+            tiles = bytearray(width * height)
+            view = memoryview(tiles)
+            decompressor = zlib.decompressobj()
+            offset = 0
+            data = f.read(cls.READ_CHUNK)
+            while data and offset < len(tiles):
+                # Bounded output per step keeps peak memory at the grid size
+                chunk = decompressor.decompress(data, cls.READ_CHUNK)
+                view[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+                data = decompressor.unconsumed_tail or f.read(cls.READ_CHUNK)
+            view.release()
+            if offset != width * height:
+                raise ValueError(f"{path} is truncated: {offset} of {width * height} tiles")
+        return cls(width, height, palette, tile_size, tiles)
+
+
+# Positions and velocities of every dynamic body in flat NumPy arrays. One
+# step() moves all of them at once: friction on undriven bodies, speed clamp,
+# gravity, terminal velocity, then axis-separated collision against the
+# TileMap byte grid (the first solid tile in row-major order wins, like
+# TileMap.collide). Sprites such as Player keep an index into the store and
+# read/write their state through it; sync() copies positions back to rects,
+# so teleport a body with place() rather than by moving its rect.
+class PhysicsStore:
+    def __init__(self, capacity=16, terminal_velocity=TERMINAL_VELOCITY):
+        self.terminal_velocity = terminal_velocity
+        self.count = 0  # slots in use (including freed ones below count)
+        self.owners = []
+        self.free = []
+        self.pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.size = np.zeros((capacity, 2))
+        self.gravity = np.zeros(capacity)
+        self.friction = np.ones(capacity)
+        self.max_speed = np.full(capacity, np.inf)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.driven = np.zeros(capacity, dtype=bool)  # input applied this step
+        self.landed = np.zeros(capacity, dtype=bool)  # hit the floor last step
+        self.grid = None
+        self.tile_size = TILE_SIZE
+        self.checks = 0  # bodies tested against the grid, per axis
+
+    def grow(self):
+        capacity = len(self.pos) * 2
+        for name in ("pos", "vel", "size", "gravity", "friction", "max_speed",
+                     "active", "driven", "landed"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, owner, rect, gravity=0.0, friction=1.0, max_speed=np.inf):
+        if self.free:
+            index = self.free.pop()
+            self.owners[index] = owner
+        else:
+            if self.count == len(self.pos):
+                self.grow()
+            index = self.count
+            self.count += 1
+            self.owners.append(owner)
+        self.pos[index] = rect.topleft
+        self.vel[index] = 0
+        self.size[index] = rect.size
+        self.gravity[index] = gravity
+        self.friction[index] = friction
+        self.max_speed[index] = max_speed
+        self.active[index] = True
+        self.driven[index] = self.landed[index] = False
+        return index
+
+    def remove(self, index):
+        self.active[index] = False
+        self.owners[index] = None
+        self.free.append(index)
+
+    def place(self, index, rect):
+        self.pos[index] = rect.topleft
+
+    def set_tilemap(self, tilemap):
+        # A view onto the tilemap's bytes, so later tile edits are seen too
+        if tilemap is None:
+            self.grid = None
+            return
+        self.grid = np.frombuffer(tilemap.tiles, dtype=np.uint8).reshape(tilemap.height, tilemap.width)
+        self.tile_size = tilemap.tile_size
+
+    def first_hits(self, pos, size):
+        # Per body: whether it overlaps a solid tile, and that tile's (tx, ty)
+        n = len(pos)
+        if self.grid is None or n == 0:
+            return np.zeros(n, dtype=bool), None
+        self.checks += n
+        ts = self.tile_size
+        shape = self.grid.shape[::-1]  # (width, height)
+        # Tile range per body and axis, clipped to the map like tile_range()
+        lo = np.maximum(pos // ts, 0).astype(np.intp)
+        hi = np.minimum((pos + size - 1) // ts + 1, shape).astype(np.intp)
+        span_x, span_y = np.maximum((hi - lo).max(axis=0), 1).tolist()
+
+        tx = lo[:, 0, None, None] + np.arange(span_x)
+        ty = lo[:, 1, None, None] + np.arange(span_y)[:, None]
+        inside = (tx < hi[:, 0, None, None]) & (ty < hi[:, 1, None, None])
+        solid = (self.grid[np.minimum(ty, shape[1] - 1), np.minimum(tx, shape[0] - 1)] != 0) & inside
+        solid = solid.reshape(n, -1)
+        first = solid.argmax(axis=1)
+        hit = solid[np.arange(n), first]
+        return hit, lo + np.stack((first % span_x, first // span_x), axis=1)
+
+    def edges(self, pos, tiles):
+        # Per body hit edges (left, top, right, bottom) in pixels
+        edges = np.zeros((len(pos), 4))
+        if tiles is not None:
+            edges[:, :2] = tiles * self.tile_size
+            edges[:, 2:] = edges[:, :2] + self.tile_size
+        return edges
+
+    def step(self):
+        if self.free:
+            index = np.flatnonzero(self.active[:self.count])
+        else:
+            index = slice(0, self.count)  # every slot is live: work on views
+        pos = self.pos[index]
+        vel = self.vel[index]
+        size = self.size[index]
+        if not len(pos):
+            return
+        vx, vy = vel[:, 0], vel[:, 1]
+
+        # Friction when there was no input, then speed limits and gravity
+        vx *= np.where(self.driven[index], 1.0, self.friction[index])
+        np.clip(vx, -self.max_speed[index], self.max_speed[index], out=vx)
+        vy += self.gravity[index]
+        np.minimum(vy, self.terminal_velocity, out=vy)
+
+        # Horizontal move and collision (whole pixels, like Rect.x += int(v))
+        pos[:, 0] += np.trunc(vx)
+        hit, tiles = self.first_hits(pos, size)
+        edges = self.edges(pos, tiles)
+        pos[:, 0] = np.where(hit & (vx > 0), edges[:, 0] - size[:, 0],
+                             np.where(hit & (vx < 0), edges[:, 2], pos[:, 0]))
+        vx[hit] = 0
+
+        # Vertical move and collision
+        pos[:, 1] += np.trunc(vy)
+        hit, tiles = self.first_hits(pos, size)
+        edges = self.edges(pos, tiles)
+        down = hit & (vy > 0)
+        up = hit & (vy < 0)
+        pos[:, 1] = np.where(down, edges[:, 1] - size[:, 1], np.where(up, edges[:, 3], pos[:, 1]))
+        vy[down | up] = 0
+
+        if isinstance(index, np.ndarray):
+            self.pos[index] = pos
+            self.vel[index] = vel
+        self.landed[index] = down
+        self.driven[index] = False
+
+    def sync(self):
+        # Copy the integer positions back onto the owners' rects
+        positions = self.pos[:self.count].astype(int).tolist()
+        for owner, active, topleft in zip(self.owners, self.active[:self.count].tolist(), positions):
+            if active and owner is not None:
+                owner.rect.topleft = topleft
+
+
+# Static terrain pre-rendered into chunk surfaces. Terrain never moves, so a
+# chunk is baked the first time it is drawn and each frame only costs one
+# blit per visible chunk. Chunks are re-baked only when the level changes and
+# at most MAX_TERRAIN_CHUNKS stay baked, so huge maps don't bake everything.
+class TerrainLayer:
+    def __init__(self, chunk_size=TERRAIN_CHUNK_SIZE, max_chunks=MAX_TERRAIN_CHUNKS):
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.tilemap = None
+        self.tile_images = []
+        self.chunks = OrderedDict()  # (cx, cy) -> baked Surface, or None if empty
+        self.bakes = 0
+        self.version = 0  # Bumped whenever the terrain changes
+
+    def chunk_keys(self, rect):
+        size = self.chunk_size
+        for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                yield (cx, cy)
+
+    def set_tilemap(self, tilemap):
+        self.tilemap = tilemap
+        self.tile_images = tilemap.images() if tilemap else []
+        self.invalidate()
+
+    def invalidate(self):
+        # Drop all baked chunks; they re-bake lazily
+        self.version += 1
+        self.chunks.clear()
+
+    def bake_chunk(self, key):
+        size = self.chunk_size
+        origin_x, origin_y = key[0] * size, key[1] * size
+        blits = []
+
+        tilemap = self.tilemap
+        if tilemap is not None:
+            ts = tilemap.tile_size
+            x0, x1, y0, y1 = tilemap.tile_range(pygame.Rect(origin_x, origin_y, size, size))
+            images = self.tile_images
+            tiles = tilemap.tiles
+            for ty in range(y0, y1):
+                row = ty * tilemap.width
+                y = ty * ts - origin_y
+                for tx, tile_id in enumerate(tiles[row + x0:row + x1], x0):
+                    if tile_id:
+                        blits.append((images[tile_id], (tx * ts - origin_x, y)))
+
+        if not blits:
+            return None
+        chunk = pygame.Surface((size, size), pygame.SRCALPHA)
+        chunk.blits(blits, doreturn=False)
+        self.bakes += 1
+        return chunk
+
+    def get_chunk(self, key):
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+        chunk = self.chunks[key] = self.bake_chunk(key)
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def draw(self, surface, view=None):
+        # view is the world rect shown on surface; only its chunks are drawn
+        if view is None:
+            view = surface.get_rect()
+        size = self.chunk_size
+        for key in self.chunk_keys(view):
+            chunk = self.get_chunk(key)
+            if chunk is not None:
+                surface.blit(chunk, (key[0] * size - view.x, key[1] * size - view.y))
+
 # Add these new classes after the existing imports
 
 class VirtualJoystick:
@@ -805,10 +2246,10 @@ class VirtualJoystick:
             y = self.position[1] + math.sin(angle) * self.radius
             return (int(x), int(y))
         
-    def update(self):
-        # Update joystick state based on mouse input
-        mouse_pos = pygame.mouse.get_pos()
-        mouse_pressed = pygame.mouse.get_pressed()[0]  # Left mouse button
+    def update(self, mouse):
+        # Update joystick state from the frame's mouse state (x, y, left button)
+        mouse_x, mouse_y, mouse_pressed = mouse
+        mouse_pos = (mouse_x, mouse_y)
 
         if mouse_pressed:
             if self.active or math.dist(mouse_pos, self.position) <= self.radius:
@@ -841,167 +2282,562 @@ class TouchButton:
         pygame.draw.rect(screen, color, self.rect, border_radius=10)
         pygame.draw.rect(screen, (200, 200, 200), self.rect, 2, border_radius=10)
         
-        text_surface = self.font.render(self.text, True, (255, 255, 255))
+        text_surface = TEXT.render(self.font, self.text, (255, 255, 255))
         text_rect = text_surface.get_rect(center=self.rect.center)
         screen.blit(text_surface, text_rect)
 
-# Modify the Game class to include touch controls
-class Game:
+# Retained quiz dialog. When the dialog opens, the world as last drawn is
+# copied and dimmed once (no per-frame SRCALPHA overlay). The chrome is
+# composed over that copy into one opaque surface and recomposed only when
+# the NPC's dialog_state() changes: hover, answer, result or the timer's
+# second. A dialog frame is then a single blit plus the feedback tweens.
+class DialogLayer:
     def __init__(self):
-        
-        # Add touch controls
-        self.joystick = VirtualJoystick()
-        self.jump_button = TouchButton(WIDTH - 150, HEIGHT - 150, 100, 100, "Jump")
-        self.interact_button = TouchButton(WIDTH - 150, HEIGHT - 270, 100, 100, "Action")
-        self.all_sprites = pygame.sprite.Group()
-        self.blocks = pygame.sprite.Group()
-        
-        self.create_level()
-        
-        
-    def create_level(self):
-        # Contoh sederhana pembuatan level
-        # Anda bisa mengubah ini sesuai dengan desain level yang diinginkan
-        ground_y = HEIGHT - 64  # 64 piksel dari bawah layar
-        
-        # Membuat tanah
-        for x in range(0, WIDTH, 32):
-            if x == 0 or x == WIDTH - 32:
-                # Blok ujung menggunakan tekstur rumput
-                block = Block(x, ground_y, "grass")
-            else:
-                # Blok tengah menggunakan tekstur tanah
-                block = Block(x, ground_y, "dirt")
-            self.all_sprites.add(block)
-            self.blocks.add(block)
-        
-        # Membuat beberapa platform
-        platforms = [
-            (200, HEIGHT - 200, 5, "stone"),  # (x, y, width, type)
-            (500, HEIGHT - 300, 7, "grass"),
-            (800, HEIGHT - 150, 4, "stone"),
-        ]
-        
-        for plat in platforms:
-            x, y, width, terrain_type = plat
-            for i in range(width):
-                block = Block(x + i * 32, y, terrain_type)
-                self.all_sprites.add(block)
-                self.blocks.add(block)
-        
-    def events(self):
-        try:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_m:  # Press M to mute/unmute
-                        self.toggle_music()
-                    elif event.key == pygame.K_UP:  # Volume up
-                        current_volume = pygame.mixer.music.get_volume()
-                        self.set_music_volume(min(1.0, current_volume + 0.1))
-                    elif event.key == pygame.K_DOWN:  # Volume down
-                        current_volume = pygame.mixer.music.get_volume()
-                        self.set_music_volume(max(0.0, current_volume - 0.1))
-                    if event.key == pygame.K_SPACE:
-                        self.player.jump()
-                    elif event.key == pygame.K_ESCAPE:
-                        if self.npc.show_dialog:
-                            self.npc.show_dialog = False
-                            self.npc.show_result = False
-                        else:
-                            self.running = False
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    pos = pygame.mouse.get_pos()
-                    if math.dist(pos, self.joystick.position) <= self.joystick.radius:
-                        self.joystick.active = True
-                        self.joystick.touch_position = pos
-                    elif self.jump_button.rect.collidepoint(pos):
-                        self.jump_button.pressed = True
-                        self.player.jump()
-                    elif self.interact_button.rect.collidepoint(pos):
-                        self.interact_button.pressed = True
-                        if self.npc.can_interact(self.player):
-                            self.npc.show_dialog = True
-                    elif self.npc.show_dialog:
-                        self.npc.handle_click(pos)
-                elif event.type == pygame.MOUSEBUTTONUP:
-                    self.joystick.active = False
-                    self.joystick.touch_position = None
-                    self.jump_button.pressed = False
-                    self.interact_button.pressed = False
-                elif event.type == pygame.MOUSEMOTION:
-                    mouse_pos = pygame.mouse.get_pos()  # Get current mouse position
-                    if self.joystick.active:
-                        self.joystick.touch_position = mouse_pos
-                    if self.npc.show_dialog:
-                        self.npc.handle_hover(mouse_pos)
+        self.backdrop = None
+        self.surface = None
+        self.captured = False
+        self.state = None
+        self.composes = 0
+
+    def capture(self, screen):
+        if self.backdrop is None:
+            self.backdrop = screen.copy()
+            self.surface = screen.copy()
+        else:
+            self.backdrop.blit(screen, (0, 0))
+        self.backdrop.fill(DIALOG_DIM, special_flags=pygame.BLEND_MULT)
+        self.captured = True
+        self.state = None
+
+    def release(self):
+        self.captured = False
+        self.state = None
+
+    def invalidate(self):
+        self.state = None
+
+    def draw(self, screen, npc):
+        state = npc.dialog_state()
+        if state != self.state:
+            self.surface.blit(self.backdrop, (0, 0))
+            npc.draw_dialog(self.surface)
+            self.state = state
+            self.composes += 1
+        screen.blit(self.surface, (0, 0))
+        npc.draw_feedback(screen)
+
+
+# Viewport onto the world. Everything in the level lives in world
+# coordinates; the camera follows the player, stays inside the level bounds
+# and gives the world rect to draw. Like the player it keeps its previous
+# position so rendering can interpolate between fixed steps.
+class Camera:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.x = self.y = 0.0
+        self.prev_pos = (0.0, 0.0)
+        self.world = None
+
+    def set_world(self, rect):
+        self.world = rect
+
+    def clamp(self, x, y):
+        world = self.world
+        if world is not None:
+            # Levels smaller than the screen stay pinned to their top-left
+            x = max(world.left, min(x, world.right - self.width))
+            y = max(world.top, min(y, world.bottom - self.height))
+        return x, y
+
+    def follow(self, target, lerp=CAMERA_LERP):
+        self.prev_pos = (self.x, self.y)
+        goal_x, goal_y = self.clamp(target.centerx - self.width / 2,
+                                    target.centery - self.height / 2)
+        self.x += (goal_x - self.x) * lerp
+        self.y += (goal_y - self.y) * lerp
+        if abs(goal_x - self.x) < 0.5 and abs(goal_y - self.y) < 0.5:
+            self.x, self.y = goal_x, goal_y
+
+    def snap(self, target):
+        self.x, self.y = self.clamp(target.centerx - self.width / 2,
+                                    target.centery - self.height / 2)
+        self.prev_pos = (self.x, self.y)
+
+    def view(self, alpha=1.0):
+        # World rect visible on screen, interpolated like the sprites
+        x = self.prev_pos[0] + (self.x - self.prev_pos[0]) * alpha
+        y = self.prev_pos[1] + (self.y - self.prev_pos[1]) * alpha
+        return pygame.Rect(round(x), round(y), self.width, self.height)
+
+    def to_world(self, pos, alpha=1.0):
+        view = self.view(alpha)
+        return pos[0] + view.x, pos[1] + view.y
+
+# Opt-in dirty-rectangle renderer. Each frame the game lists its drawable
+# elements as (key, rect, state, draw); only elements whose rect or state
+# changed are redrawn, over a cached background (black + baked terrain),
+# clipped to the merged changed regions which are then pushed with
+# display.update(rects) instead of a full flip.
+class DirtyRenderer:
+    def __init__(self, size):
+        self.background = pygame.Surface(size)
+        self.background_version = None
+        self.previous = {}  # key -> (rect, state) drawn last frame
+        self.full_redraw = True
+        self.pixels_touched = 0
+        self.rects_updated = 0
+
+    def invalidate(self):
+        self.full_redraw = True
+
+    def update_background(self, terrain, view):
+        # Scrolling changes the whole background, so it forces a full redraw
+        version = (terrain.version, view.topleft)
+        if self.background_version != version:
+            self.background.fill(BLACK)
+            terrain.draw(self.background, view)
+            self.background_version = version
+            self.full_redraw = True
+
+    @staticmethod
+    def merge(rects, bounds):
+        merged = []
+        for rect in rects:
+            rect = rect.clip(bounds)
+            if not rect.width or not rect.height:
+                continue
+            i = 0
+            while i < len(merged):
+                if rect.colliderect(merged[i]):
+                    rect.union_ip(merged.pop(i))
+                    i = 0
+                else:
+                    i += 1
+            merged.append(rect)
+        return merged
+
+    def render(self, surface, elements):
+        current = {}
+        dirty = []
+        for key, rect, state, _ in elements:
+            current[key] = (rect, state)
+            previous = self.previous.get(key)
+            if previous != (rect, state):
+                dirty.append(rect)
+                if previous is not None:
+                    dirty.append(previous[0])
+        for key, (rect, _) in self.previous.items():
+            if key not in current:
+                dirty.append(rect)
+        self.previous = current
+
+        bounds = surface.get_rect()
+        if self.full_redraw:
+            surface.blit(self.background, (0, 0))
+            for _, _, _, draw in elements:
+                draw(surface)
+            pygame.display.flip()
+            self.full_redraw = False
+            self.pixels_touched = bounds.width * bounds.height
+            self.rects_updated = 1
+            return [bounds]
+
+        # Grow each region to cover whole elements it touches: shapes drawn
+        # with pygame.draw don't come out pixel-identical when clipped
+        rects = self.merge(dirty, bounds)
+        grown = True
+        while grown:
+            grown = False
+            for i, rect in enumerate(rects):
+                for _, element_rect, _, _ in elements:
+                    if element_rect.colliderect(rect) and not rect.contains(element_rect.clip(bounds)):
+                        rect = rects[i] = rect.union(element_rect)
+                        grown = True
+            if grown:
+                rects = self.merge(rects, bounds)
+
+        for rect in rects:
+            surface.set_clip(rect)
+            surface.blit(self.background, rect, rect)
+            for _, element_rect, _, draw in elements:
+                if element_rect.colliderect(rect):
+                    draw(surface)
+        surface.set_clip(None)
+        if rects:
+            pygame.display.update(rects)
+        self.pixels_touched = sum(rect.width * rect.height for rect in rects)
+        self.rects_updated = len(rects)
+        return rects
+
+# Fixed-timestep frame clock. Real elapsed time is collected in an
+# accumulator and drained in SIM_DT simulation steps, so game speed no longer
+# depends on the frame rate. The time left in the accumulator is the render
+# interpolation factor. Frames are paced by the asyncio loop (frame_delay),
+# not by a blocking Clock.tick, so other tasks can run between frames.
+class FrameClock:
+    HISTORY = 120  # frames kept for fps/jitter stats
+
+    def __init__(self, fps=FPS, dt=SIM_DT, max_steps=MAX_SIM_STEPS):
+        self.fps = fps
+        self.dt = dt
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.sim_time = 0.0
+        self.frame = 0
+        self.skipped_steps = 0
+        self.frame_start = None
+        self.deadline = None  # When the next frame is due
+        self.intervals = deque(maxlen=self.HISTORY)
+        self.timings = {"events": 0.0, "update": 0.0, "draw": 0.0, "frame": 0.0, "steps": 0}
+
+    def tick(self):
+        # Start a frame and return how many steps to simulate
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            elapsed = now - self.frame_start
+            self.intervals.append(elapsed)
+            self.accumulator += elapsed
+        self.frame_start = now
+
+        # Fixed deadlines keep the average rate exact even though each
+        # sleep overshoots a little; resync when we fall a frame behind
+        period = 1.0 / self.fps
+        if self.deadline is None or now - self.deadline > period:
+            self.deadline = now
+        self.deadline += period
+        steps = int(self.accumulator / self.dt)
+        if steps > self.max_steps:
+            # Too far behind: drop the excess instead of spiralling
+            self.skipped_steps += steps - self.max_steps
+            self.accumulator -= (steps - self.max_steps) * self.dt
+            steps = self.max_steps
+        return steps
+
+    def tick_unpaced(self):
+        # Headless: no waiting, exactly one step per frame
+        self.accumulator += self.dt
+        return 1
+
+    def frame_delay(self):
+        # Seconds left until the next frame is due
+        if self.deadline is None:
+            return 0.0
+        return max(0.0, self.deadline - time.perf_counter())
+
+    def step(self):
+        self.accumulator -= self.dt
+        self.sim_time += self.dt
+
+    @property
+    def alpha(self):
+        return max(0.0, min(1.0, self.accumulator / self.dt))
+
+    def record(self, events, update, draw, steps):
+        # Per-frame timings in milliseconds
+        self.frame += 1
+        self.timings = {
+            "events": events * 1000,
+            "update": update * 1000,
+            "draw": draw * 1000,
+            "frame": (events + update + draw) * 1000,
+            "steps": steps,
+        }
 
-            # Handle joystick movement
-            if self.joystick.active:
-                x_value, _ = self.joystick.get_value()
-                if x_value < -0.2:
-                    self.player.move_left()
-                elif x_value > 0.2:
-                    self.player.move_right()
+    def get_fps(self):
+        if not self.intervals:
+            return 0.0
+        return len(self.intervals) / sum(self.intervals)
+
+    def stats(self):
+        # Frame pacing over the last HISTORY frames, in milliseconds. Jitter
+        # is the standard deviation of the frame interval around its mean.
+        stats = dict(self.timings)
+        stats.update(fps=self.get_fps(), skipped_steps=self.skipped_steps,
+                     interval_ms=0.0, jitter_ms=0.0, jitter_max_ms=0.0)
+        if self.intervals:
+            mean = sum(self.intervals) / len(self.intervals)
+            variance = sum((i - mean) ** 2 for i in self.intervals) / len(self.intervals)
+            target = 1.0 / self.fps
+            stats.update(interval_ms=mean * 1000, jitter_ms=variance ** 0.5 * 1000,
+                         jitter_max_ms=max(abs(i - target) for i in self.intervals) * 1000)
+        return stats
+
+
+# Frame profiler. Timed scopes (events/update/draw, each update system and
+# the draw passes) are kept as (name, start, duration) while recording is on,
+# so a frame spike can be inspected afterwards in chrome://tracing or
+# Perfetto via export_chrome_trace(). Frame times and per-frame counters are
+# always kept for the last PROFILER_FRAMES frames for the on-screen overlay.
+class ProfileScope:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
 
-            # Handle continuous key presses
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-                self.player.move_left()
-            if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-                self.player.move_right()
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
 
-        except Exception as e:
-            print(f"Error in events: {e}")
-            
-    def handle_events(self):
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self.running = False
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                if self.jump_button.rect.collidepoint(event.pos):
-                    self.player.jump()
-
-        # Handle continuous joystick input
-        joy_x, joy_y = self.joystick.get_value()
-        if abs(joy_x) > 0.1:  # Apply dead zone
-            self.player.vel_x = joy_x * self.player.max_speed
-        else:
-            self.player.vel_x *= 0.9  # Apply friction when no input
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter() - self.start)
 
-    def draw(self):
-        screen.fill(BLACK)
-        self.all_sprites.draw(screen)
-        
-        # Draw touch controls
-        self.joystick.draw(screen)
-        self.jump_button.draw(screen)
-        self.interact_button.draw(screen)
-        
-        pygame.display.flip()
 
-class Game:
+class Profiler:
+    NULL_SCOPE = contextlib.nullcontext()
+
+    def __init__(self, max_frames=PROFILER_FRAMES, max_events=PROFILER_EVENTS):
+        self.recording = False
+        self.origin = time.perf_counter()
+        self.events = deque(maxlen=max_events)  # (name, start, duration)
+        self.frame_times = deque(maxlen=max_frames)  # seconds
+        self.counters = deque(maxlen=max_frames)  # (start, {name: value})
+
+    def scope(self, name):
+        return ProfileScope(self, name) if self.recording else self.NULL_SCOPE
+
+    def add(self, name, start, duration):
+        if self.recording:
+            self.events.append((name, start, duration))
+
+    def system_hook(self, name, seconds):
+        # SystemPipeline.hook: called right after the system finished
+        self.add(name, time.perf_counter() - seconds, seconds)
+
+    def end_frame(self, start, duration, **counters):
+        self.add("frame", start, duration)
+        self.frame_times.append(duration)
+        self.counters.append((start, counters))
+
+    def last(self, name, default=0):
+        return self.counters[-1][1].get(name, default) if self.counters else default
+
+    def stats(self):
+        times = sorted(self.frame_times)
+        if not times:
+            return {}
+        return {
+            "frames": len(times),
+            "frame_ms_avg": sum(times) / len(times) * 1000,
+            "frame_ms_p99": times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+            "frame_ms_max": times[-1] * 1000,
+        }
+
+    def chrome_trace(self):
+        # Trace Event Format: complete ("X") events plus counter ("C") tracks
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": 0,
+                   "ts": round((start - self.origin) * 1e6, 1), "dur": round(duration * 1e6, 1)}
+                  for name, start, duration in self.events]
+        events.extend({"name": "counters", "ph": "C", "pid": pid, "tid": 0,
+                       "ts": round((start - self.origin) * 1e6, 1), "args": counters}
+                      for start, counters in self.counters if counters)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+    def clear(self):
+        self.events.clear()
+        self.frame_times.clear()
+        self.counters.clear()
+
+
+# Per-step update pipeline. Game.update runs every registered system exactly
+# once per simulation step, in order, and each system handles all of its
+# entities in one go. calls counts the runs of each system since the last
+# begin_frame(); hook, if set, is called as hook(name, seconds) after every
+# system so profilers and tests can attach without touching the systems.
+class SystemPipeline:
     def __init__(self):
+        self.systems = []
+        self.calls = {}
+        self.hook = None
+
+    def add(self, name, system):
+        self.systems.append((name, system))
+        self.calls[name] = 0
+
+    def begin_frame(self):
+        for name in self.calls:
+            self.calls[name] = 0
+
+    def run(self):
+        hook = self.hook
+        calls = self.calls
+        for name, system in self.systems:
+            if hook is None:
+                system()
+            else:
+                start = time.perf_counter()
+                system()
+                hook(name, time.perf_counter() - start)
+            calls[name] += 1
+
+
+# A recorded session: the seed and level the game started from, then each
+# frame's simulation step count, input events and mouse state. Everything
+# else the simulation reads is derived from those, so Game.replay() steps
+# through the exact same states, as fast as the CPU allows.
+#
+# On disk (.p5rec): a little-endian header (magic, version, seed, FPS, frame
+# count, digest of the final state), the level path as length-prefixed UTF-8,
+# then the zlib-compressed frame stream. A frame is one flag byte (step count
+# in the low nibble, "mouse changed" and "has events" bits), the mouse as
+# x, y, button if it changed, and an event count plus 5 bytes per event if
+# there were any: a frame without input is a single byte.
+class InputRecording:
+    MAGIC = b"P5RC"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBQHI16s")
+    MOUSE = struct.Struct("<hhB")
+    COUNT = struct.Struct("<H")
+    KEY_EVENT = struct.Struct("<Bi")
+    MOUSE_EVENT = struct.Struct("<Bhh")
+    STEPS = 0x0F
+    MOUSE_CHANGED = 0x10
+    HAS_EVENTS = 0x20
+    # Only the event types Game.events() reacts to are recorded
+    EVENT_CODES = {pygame.QUIT: 0, pygame.KEYDOWN: 1, pygame.KEYUP: 2,
+                   pygame.MOUSEBUTTONDOWN: 3, pygame.MOUSEBUTTONUP: 4, pygame.MOUSEMOTION: 5}
+    EVENT_TYPES = {code: event_type for event_type, code in EVENT_CODES.items()}
+    FIRST_MOUSE_CODE = 3
+
+    def __init__(self, seed, level=LEVEL_PATH, fps=FPS, data=b"", frame_count=0, digest=bytes(16)):
+        self.seed = seed
+        self.level = level
+        self.fps = fps
+        self.data = bytearray(data)
+        self.frame_count = frame_count
+        self.digest = digest  # Game.state_digest() after the last frame
+        self.mouse = (0, 0, 0)  # last mouse state written
+
+    def __len__(self):
+        return self.frame_count
+
+    def add(self, steps, events, mouse):
+        if not 0 <= steps <= self.STEPS:
+            raise ValueError(f"cannot record {steps} steps in one frame")
+        flags = steps
+        if mouse != self.mouse:
+            flags |= self.MOUSE_CHANGED
+        if events:
+            flags |= self.HAS_EVENTS
+        data = self.data
+        data.append(flags)
+        if flags & self.MOUSE_CHANGED:
+            data += self.MOUSE.pack(*mouse)
+            self.mouse = mouse
+        if events:
+            data += self.COUNT.pack(len(events))
+            for event_type, a, b in events:
+                code = self.EVENT_CODES[event_type]
+                if code >= self.FIRST_MOUSE_CODE:
+                    data += self.MOUSE_EVENT.pack(code, a, b)
+                else:
+                    data += self.KEY_EVENT.pack(code, a)
+        self.frame_count += 1
+
+    def frames(self):
+        # Yield (steps, events, mouse) for every recorded frame
+        data = self.data
+        offset = 0
+        mouse = (0, 0, 0)
+        for _ in range(self.frame_count):
+            flags = data[offset]
+            offset += 1
+            if flags & self.MOUSE_CHANGED:
+                mouse = self.MOUSE.unpack_from(data, offset)
+                offset += self.MOUSE.size
+            events = []
+            if flags & self.HAS_EVENTS:
+                count, = self.COUNT.unpack_from(data, offset)
+                offset += self.COUNT.size
+                for _ in range(count):
+                    code = data[offset]
+                    if code >= self.FIRST_MOUSE_CODE:
+                        _, a, b = self.MOUSE_EVENT.unpack_from(data, offset)
+                    else:
+                        _, a = self.KEY_EVENT.unpack_from(data, offset)
+                        b = 0
+                    offset += self.KEY_EVENT.size
+                    events.append((self.EVENT_TYPES[code], a, b))
+            yield flags & self.STEPS, events, mouse
+
+    def save(self, path):
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, self.fps,
+                                  self.frame_count, self.digest)
+        level = self.level.encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(header)
+            f.write(self.COUNT.pack(len(level)) + level)
+            f.write(zlib.compress(bytes(self.data), 6))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, version, seed, fps, frame_count, digest = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError(f"{path} is not a version {cls.VERSION} recording")
+            length, = cls.COUNT.unpack(f.read(cls.COUNT.size))
+            level = f.read(length).decode("utf-8")
+            data = zlib.decompress(f.read())
+        if fps != FPS:
+            raise ValueError(f"{path} was recorded at {fps} FPS, the game runs at {FPS}")
+        return cls(seed, level, fps, data, frame_count, digest)
+
+
+class Game:
+    def __init__(self, headless=HEADLESS, dirty_rects=DIRTY_RECTS, quiz_log=QUIZ_LOG_PATH,
+                 seed=None, level=LEVEL_PATH):
+        self.startup_start = time.perf_counter()
+        self.time_to_first_frame = None
         self.running = True
+        self.headless = headless
+        self.audio = AudioManager()
+        self.frame_clock = FrameClock()
+        self.dirty_renderer = DirtyRenderer((WIDTH, HEIGHT)) if dirty_rects else None
+        self.dialog_layer = DialogLayer()
+        self.quiz_log = QuizLog(quiz_log)  # opened on the first quiz event
+        self.keys_held = set()  # Tracked from KEYDOWN/KEYUP so input can be scripted
+        self.mouse = (0, 0, 0)  # x, y, left button, as of this frame's input
+        self.recording = None  # InputRecording the frames' input is appended to
+        # Every random choice the simulation makes comes from this generator
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.level_path = level
+        self.tasks = set()  # Background asyncio tasks sharing the frame loop
+        self.pending_tasks = []
         self.debug_font = pygame.font.Font(None, 36)
+        self.profiler = Profiler()
+        self.show_profiler = False  # overlay, toggled with PROFILER_KEY
+        self.tracing = False  # keep trace events for export_trace()
+        self.collision_checks = 0
 
         # Create sprite groups
         self.all_sprites = pygame.sprite.Group()
-        self.blocks = pygame.sprite.Group()
+        self.moving_sprites = pygame.sprite.Group()  # Sprites with a prev_pos, culled one by one
         self.npcs = pygame.sprite.Group()
+        self.terrain = TerrainLayer()
+        self.sprite_grid = SpatialGrid(SPRITE_CELL_SIZE)  # Non-moving sprites, for culling
+        self.tilemap = None
+        self.camera = Camera(WIDTH, HEIGHT)
+        self.physics = PhysicsStore()
 
         # Create player
         self.player = Player(self)
         self.all_sprites.add(self.player)
+        self.moving_sprites.add(self.player)
 
         # Create NPC
-        self.npc = NPC(WIDTH // 2, 100, "Rock Head")
-        self.all_sprites.add(self.npc)
-        self.npcs.add(self.npc)
+        self.npc = NPC(WIDTH // 2, 100, "Rock Head", self.rng)
+        self.add_npc(self.npc)
 
         # Create level
-        self.create_level()
+        self.create_level(level)
 
         # Add touch controls
         self.joystick = VirtualJoystick()
@@ -1025,69 +2861,103 @@ class Game:
             "If debugging is the process of removing software bugs, then programming must be the process of putting them in."
         ]
 
-        # Add background music
-        try:
-            pygame.mixer.music.load('assets/Skyfall x Attack on Titan.mp3')
-            pygame.mixer.music.set_volume(0.5)
-            pygame.mixer.music.play(-1)
-        except:
-            print("Could not load background music")
-
-    def create_level(self):
-        # Contoh sederhana pembuatan level
-        # Anda bisa mengubah ini sesuai dengan desain level yang diinginkan
-        ground_y = HEIGHT - 64  # 64 piksel dari bawah layar
-        
-        # Membuat tanah
-        for x in range(0, WIDTH, 32):
-            if x == 0 or x == WIDTH - 32:
-                # Blok ujung menggunakan tekstur rumput
-                block = Block(x, ground_y, "grass")
-            else:
-                # Blok tengah menggunakan tekstur tanah
-                block = Block(x, ground_y, "dirt")
-            self.all_sprites.add(block)
-            self.blocks.add(block)
-        
-        # Membuat beberapa platform
-        platforms = [
-            (200, HEIGHT - 200, 5, "stone"),  # (x, y, width, type)
-            (500, HEIGHT - 300, 7, "grass"),
-            (800, HEIGHT - 150, 4, "stone"),
-        ]
-        
-        for plat in platforms:
-            x, y, width, terrain_type = plat
-            for i in range(width):
-                block = Block(x + i * 32, y, terrain_type)
-                self.all_sprites.add(block)
-                self.blocks.add(block)
-
-    def events(self):
+        # Update systems, in the order Game.update runs them
+        self.systems = SystemPipeline()
+        self.systems.add("input", self.update_input)
+        self.systems.add("physics", self.update_physics)
+        self.systems.add("animation", self.update_animation)
+        self.systems.add("dialog", self.update_dialog)
+        self.systems.add("camera", self.update_camera)
+
+        # Start background music once, after the level is built
+        self.audio.play_music(BACKGROUND_MUSIC, MUSIC_VOLUME)
+
+        # Only the animations shown on the first frame were decoded so far;
+        # decode the rest between frames
+        self.spawn(self.player.SPRITES.warm)
+        self.spawn(self.npc.SPRITES.warm)
+        # Index the question banks off the frame loop before a dialog needs them
+        self.spawn(self.prepare_questions)
+
+    async def prepare_questions(self):
+        for path in sorted({npc.type.question_path for npc in self.npcs}):
+            if path.endswith(".jsonl"):
+                try:
+                    await asyncio.to_thread(QuestionBank.prepare, path)
+                except (OSError, sqlite3.Error) as e:
+                    # QuestionBank.open() falls back to an in-memory index
+                    log.debug("Could not prepare question index for %s: %s", path, e)
+
+    def create_level(self, path=LEVEL_PATH):
+        # The level layout lives in a .p5map file (see TileMap); tiles are
+        # collided and drawn straight from its byte grid
+        self.tilemap = TileMap.load(path)
+        self.level_path = path
+        self.terrain.set_tilemap(self.tilemap)
+        self.physics.set_tilemap(self.tilemap)
+        self.camera.set_world(pygame.Rect(0, 0, self.tilemap.pixel_width, self.tilemap.pixel_height))
+        self.camera.snap(self.player.rect)
+
+    def add_npc(self, npc):
+        self.all_sprites.add(npc)
+        self.npcs.add(npc)
+        self.sprite_grid.insert(npc)
+
+    def poll_input(self, steps=1):
+        # This frame's input from pygame, as (type, key, 0) / (type, x, y)
+        # tuples plus the mouse state; appended to the recording, if any,
+        # together with the number of steps the frame will simulate
+        mouse_x, mouse_y = pygame.mouse.get_pos()
+        events = []
+        for event in pygame.event.get():
+            if event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                events.append((event.type, event.key, 0))
+            elif event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION):
+                x, y = getattr(event, "pos", (mouse_x, mouse_y))
+                events.append((event.type, x, y))
+            elif event.type == pygame.QUIT:
+                events.append((event.type, 0, 0))
+        mouse = (mouse_x, mouse_y, int(pygame.mouse.get_pressed()[0]))
+        if self.recording is not None:
+            self.recording.add(steps, events, mouse)
+        return events, mouse
+
+    def events(self, frame_input=None, steps=1):
+        # frame_input is (events, mouse) as returned by poll_input(); live
+        # input is polled when it is not given (replays pass recorded input)
         try:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
+            events, self.mouse = frame_input if frame_input is not None else self.poll_input(steps)
+            for event_type, a, b in events:
+                if event_type == pygame.QUIT:
                     self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_m:  # Press M to mute/unmute
+                elif event_type == pygame.KEYUP:
+                    self.keys_held.discard(a)
+                elif event_type == pygame.KEYDOWN:
+                    key = a
+                    self.keys_held.add(key)
+                    if key == pygame.K_m:  # Press M to mute/unmute
                         self.toggle_music()
-                    elif event.key == pygame.K_UP:  # Volume up
-                        current_volume = pygame.mixer.music.get_volume()
+                    elif key == PROFILER_KEY:
+                        self.toggle_profiler()
+                    elif key == pygame.K_UP:  # Volume up
+                        current_volume = self.audio.get_volume()
                         self.set_music_volume(min(1.0, current_volume + 0.1))
-                    elif event.key == pygame.K_DOWN:  # Volume down
-                        current_volume = pygame.mixer.music.get_volume()
+                    elif key == pygame.K_DOWN:  # Volume down
+                        current_volume = self.audio.get_volume()
                         self.set_music_volume(max(0.0, current_volume - 0.1))
-                    if event.key == pygame.K_SPACE:
+                    if key == pygame.K_SPACE and not self.npc.show_dialog:
                         self.player.jump()
-                    elif event.key == pygame.K_ESCAPE:
+                    elif key == pygame.K_ESCAPE:
                         if self.npc.show_dialog:
-                            self.npc.show_dialog = False
-                            self.npc.show_result = False
+                            self.npc.close_dialog()
                         else:
                             self.running = False
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    pos = pygame.mouse.get_pos()
-                    if math.dist(pos, self.joystick.position) <= self.joystick.radius:
+                elif event_type == pygame.MOUSEBUTTONDOWN:
+                    pos = (a, b)
+                    if self.npc.show_dialog:
+                        # The touch controls are under the dialog
+                        self.npc.handle_click(pos)
+                    elif math.dist(pos, self.joystick.position) <= self.joystick.radius:
                         self.joystick.active = True
                         self.joystick.touch_position = pos
                     elif self.jump_button.rect.collidepoint(pos):
@@ -1096,21 +2966,25 @@ class Game:
                     elif self.interact_button.rect.collidepoint(pos):
                         self.interact_button.pressed = True
                         if self.npc.can_interact(self.player):
-                            self.npc.show_dialog = True
-                    elif self.npc.show_dialog:
-                        self.npc.handle_click(pos)
-                elif event.type == pygame.MOUSEBUTTONUP:
+                            self.npc.open_dialog(self.player)
+                elif event_type == pygame.MOUSEBUTTONUP:
                     self.joystick.active = False
                     self.joystick.touch_position = None
                     self.jump_button.pressed = False
                     self.interact_button.pressed = False
-                elif event.type == pygame.MOUSEMOTION:
-                    mouse_pos = pygame.mouse.get_pos()  # Get current mouse position
+                elif event_type == pygame.MOUSEMOTION:
+                    mouse_pos = (a, b)
                     if self.joystick.active:
                         self.joystick.touch_position = mouse_pos
                     if self.npc.show_dialog:
                         self.npc.handle_hover(mouse_pos)
 
+        except Exception as e:
+            log.error("Error in events: %s", e)
+
+    def handle_input(self):
+        # Held input is applied once per simulation step, not once per frame
+        try:
             # Handle joystick movement
             if self.joystick.active:
                 x_value, _ = self.joystick.get_value()
@@ -1120,76 +2994,448 @@ class Game:
                     self.player.move_right()
 
             # Handle continuous key presses
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_LEFT] or keys[pygame.K_a]:
+            keys = self.keys_held
+            if pygame.K_LEFT in keys or pygame.K_a in keys:
                 self.player.move_left()
-            if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
+            if pygame.K_RIGHT in keys or pygame.K_d in keys:
                 self.player.move_right()
 
         except Exception as e:
-            print(f"Error in events: {e}")
+            log.error("Error in handle_input: %s", e)
 
     def update(self):
-        self.all_sprites.update()
-        self.joystick.update() 
-        
+        # One simulation step: input, physics, animation, dialog, camera
+        self.systems.run()
+
+    def update_input(self):
+        self.joystick.update(self.mouse)
+        # The quiz dialog is drawn over a still copy of the world (see
+        # DialogLayer), so player input and physics pause while it is open;
+        # held keys are still tracked and apply again once it closes
+        if self.npc.show_dialog:
+            self.player.prev_pos = self.player.rect.topleft
+            return
+        self.handle_input()
+        self.player.apply_input()
+
+    def update_physics(self):
+        if self.npc.show_dialog:
+            return
+        self.physics.step()
+        self.physics.sync()
+        self.player.after_physics()
+
+    def update_animation(self):
+        self.player.update_sprite()
+        for npc in self.npcs:
+            npc.update_sprite()
+
+    def update_dialog(self):
+        for npc in self.npcs:
+            npc.update_dialog()
+
+    def update_camera(self):
+        self.camera.follow(self.player.rect)
+
         self.meme_timer += 1
         if self.meme_timer >= FPS * 5:  # Every 5 seconds
-            self.meme_text = random.choice(self.memes)
+            self.meme_text = self.rng.choice(self.memes)
             self.meme_timer = 0
 
-    def draw(self):
+    def draw(self, alpha=1.0):
+        if self.npc.show_dialog:
+            self.draw_dialog(alpha)
+            if self.dirty_renderer is not None:
+                # The dialog covers everything; repaint fully once it closes
+                self.dirty_renderer.invalidate()
+        else:
+            if self.dialog_layer.captured:
+                self.dialog_layer.release()
+            if self.dirty_renderer is not None and not self.show_profiler:
+                self.dirty_renderer.update_background(self.terrain, self.camera.view(alpha))
+                self.dirty_renderer.render(screen, self.scene_elements(alpha))
+            else:
+                self.draw_full(alpha)
+                if self.dirty_renderer is not None:
+                    self.dirty_renderer.invalidate()
+
+        if self.time_to_first_frame is None:
+            self.report_startup()
+
+    def draw_full(self, alpha):
+        self.draw_world(alpha)
+        self.draw_hud()
+        with self.profiler.scope("flip"):
+            pygame.display.flip()
+
+    def draw_dialog(self, alpha):
+        # The world behind the dialog is drawn once, when it opens
+        layer = self.dialog_layer
+        if not layer.captured:
+            self.draw_world(alpha)
+            layer.capture(screen)
+        with self.profiler.scope("dialog"):
+            layer.draw(screen, self.npc)
+        self.draw_hud()
+        with self.profiler.scope("flip"):
+            pygame.display.flip()
+
+    def draw_world(self, alpha):
+        profiler = self.profiler
         screen.fill(BLACK)
-        self.all_sprites.draw(screen)
+        with profiler.scope("terrain"):
+            self.terrain.draw(screen, self.camera.view(alpha))
+        with profiler.scope("sprites"):
+            self.draw_sprites(screen, alpha)
 
         # Draw touch controls
-        self.joystick.draw(screen)
-        self.jump_button.draw(screen)
-        self.interact_button.draw(screen)
-
-        if self.npc.show_dialog:
-            self.npc.draw_dialog(screen)
+        with profiler.scope("controls"):
+            self.joystick.draw(screen)
+            self.jump_button.draw(screen)
+            self.interact_button.draw(screen)
 
+    def draw_hud(self):
         if self.meme_text:
-            meme_surface = self.meme_font.render(self.meme_text, True, WHITE)
+            meme_surface = TEXT.render(self.meme_font, self.meme_text, WHITE)
             meme_rect = meme_surface.get_rect(center=(WIDTH // 2, 50))
             screen.blit(meme_surface, meme_rect)
-        
-        pygame.display.flip()
 
-    def run(self):
+        if self.show_profiler:
+            self.draw_profiler(screen)
+
+    def draw_profiler(self, surface):
+        # Overlay: FPS, frame-time graph (one bar per frame, line at the
+        # frame budget), sprite count and collision checks of the last frame
+        profiler = self.profiler
+        panel = pygame.Rect(10, 90, 300, 200)
+        pygame.draw.rect(surface, (0, 0, 0), panel)
+        pygame.draw.rect(surface, WHITE, panel, 1)
+
+        lines = [
+            f"FPS: {self.frame_clock.get_fps():.0f}",
+            f"Sprites: {profiler.last('sprites')}",
+            f"Collision checks: {profiler.last('collision_checks')}",
+        ]
+        y = panel.top + 6
+        for line in lines:
+            text = TEXT.render(self.debug_font, line, WHITE)
+            surface.blit(text, (panel.left + 8, y))
+            y += text.get_height()
+
+        graph = pygame.Rect(panel.left + 8, y + 6, panel.width - 16, panel.bottom - y - 14)
+        scale = graph.height / (SIM_DT * 2000)  # two frame budgets tall
+        budget_y = graph.bottom - int(SIM_DT * 1000 * scale)
+        times = list(profiler.frame_times)[-graph.width // 2:]
+        for i, seconds in enumerate(times):
+            height = min(graph.height, max(1, int(seconds * 1000 * scale)))
+            color = GREEN if seconds <= SIM_DT else RED
+            pygame.draw.line(surface, color, (graph.left + i * 2, graph.bottom),
+                             (graph.left + i * 2, graph.bottom - height))
+        pygame.draw.line(surface, YELLOW, (graph.left, budget_y), (graph.right, budget_y))
+
+    def visible_sprites(self, view):
+        # Non-moving sprites come from the sprite grid around the view;
+        # moving ones are few, kept in their own group and checked directly
+        static = self.sprite_grid.query(view)
+        moving = [sprite for sprite in self.moving_sprites
+                  if view.colliderect(sprite.rect.inflate(64, 64))]
+        return static + moving
+
+    def sprite_positions(self, alpha):
+        # Screen positions of the visible sprites. Moving sprites are drawn
+        # between their previous and current physics position so motion
+        # stays smooth between fixed steps.
+        view = self.camera.view(alpha)
+        for sprite in self.visible_sprites(view):
+            prev_pos = getattr(sprite, "prev_pos", None)
+            if prev_pos is None:
+                x, y = sprite.rect.topleft
+            else:
+                x = prev_pos[0] + (sprite.rect.x - prev_pos[0]) * alpha
+                y = prev_pos[1] + (sprite.rect.y - prev_pos[1]) * alpha
+            yield sprite, (round(x) - view.x, round(y) - view.y)
+
+    def draw_sprites(self, surface, alpha):
+        surface.blits([(sprite.image, pos) for sprite, pos in self.sprite_positions(alpha)],
+                      doreturn=False)
+
+    def scene_elements(self, alpha):
+        # Everything draw_full puts on screen (except the quiz dialog) as
+        # (key, rect, state, draw) for the dirty-rectangle renderer
+        elements = []
+        for sprite, pos in self.sprite_positions(alpha):
+            image = sprite.image
+            elements.append((id(sprite), image.get_rect(topleft=pos), (id(image), pos),
+                             lambda surface, image=image, pos=pos: surface.blit(image, pos)))
+
+        joystick = self.joystick
+        reach = joystick.radius + joystick.radius // 2
+        elements.append(("joystick",
+                         pygame.Rect(joystick.position[0] - reach, joystick.position[1] - reach,
+                                     reach * 2 + 1, reach * 2 + 1),
+                         joystick.get_constrained_knob_pos() if joystick.active else None,
+                         joystick.draw))
+        for name, button in (("jump", self.jump_button), ("interact", self.interact_button)):
+            elements.append((name, button.rect.inflate(2, 2), button.pressed, button.draw))
+
+        if self.meme_text:
+            meme_surface = TEXT.render(self.meme_font, self.meme_text, WHITE)
+            meme_rect = meme_surface.get_rect(center=(WIDTH // 2, 50))
+            elements.append(("meme", meme_rect, self.meme_text,
+                             lambda surface: surface.blit(meme_surface, meme_rect)))
+        return elements
+
+    def report_startup(self):
+        self.time_to_first_frame = (time.perf_counter() - self.startup_start) * 1000
+        log.info("Time to first frame: %.1f ms (%d tiles, assets: %s)", self.time_to_first_frame,
+                 self.tilemap.solid_count() if self.tilemap else 0, ASSETS.stats())
+        if self.time_to_first_frame > STARTUP_BUDGET_MS:
+            log.warning("Startup exceeded budget of %d ms", STARTUP_BUDGET_MS)
+
+    def run(self, max_frames=None):
+        asyncio.run(self.run_async(max_frames))
+
+    async def run_async(self, max_frames=None):
+        for coro in self.pending_tasks:
+            self.spawn(coro)
+        self.pending_tasks = []
+        try:
+            await self.frame_loop(max_frames)
+        finally:
+            await self.cancel_tasks()
+            self.quiz_log.close()
+
+    async def frame_loop(self, max_frames=None):
+        clock = self.frame_clock
         while self.running:
+            steps = clock.tick_unpaced() if self.headless else clock.tick()
+
+            start = time.perf_counter()
+            self.systems.begin_frame()
+            self.events(steps=steps)
+            events_done = time.perf_counter()
+            for _ in range(steps):
+                self.update()
+                clock.step()
+            update_done = time.perf_counter()
+            if not self.headless:
+                self.draw(clock.alpha)
+            elif self.time_to_first_frame is None:
+                self.report_startup()
+            draw_done = time.perf_counter()
+
+            clock.record(events_done - start, update_done - events_done,
+                         draw_done - update_done, steps)
+            self.profile_frame(start, events_done, update_done, draw_done)
+            if max_frames is not None and clock.frame >= max_frames:
+                self.running = False
+
+            # Yield once per frame; background tasks run in the time left
+            # over (headless runs just yield and go on)
+            await asyncio.sleep(0 if self.headless else clock.frame_delay())
+
+    def profile_frame(self, start, events_done, update_done, draw_done):
+        profiler = self.profiler
+        profiler.add("events", start, events_done - start)
+        profiler.add("update", events_done, update_done - events_done)
+        profiler.add("draw", update_done, draw_done - update_done)
+        checks = self.physics.checks
+        profiler.end_frame(start, draw_done - start, sprites=len(self.all_sprites),
+                           collision_checks=checks - self.collision_checks)
+        self.collision_checks = checks
+
+    def set_profiling(self, recording):
+        # Record timed scopes (and time every update system) only when needed
+        self.profiler.recording = recording
+        self.systems.hook = self.profiler.system_hook if recording else None
+
+    def toggle_profiler(self):
+        self.show_profiler = not self.show_profiler
+        self.set_profiling(self.show_profiler or self.tracing)
+
+    def start_trace(self):
+        self.tracing = True
+        self.set_profiling(True)
+
+    def export_trace(self, path):
+        return self.profiler.export_chrome_trace(path)
+
+    def spawn(self, coro):
+        # Run a coroutine alongside the frame loop (asset prefetch, telemetry
+        # flush, ...). Tasks must await regularly so they never stall a frame.
+        # A coroutine function may be passed instead; it is called once the
+        # loop runs, so nothing is left un-awaited if the game never starts.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Loop not running yet: started by run_async
+            self.pending_tasks.append(coro)
+            return None
+        task = loop.create_task(coro if asyncio.iscoroutine(coro) else coro())
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+        return task
+
+    def task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Error in background task: %r", task.exception())
+
+    async def cancel_tasks(self):
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        for coro in self.pending_tasks:
+            if asyncio.iscoroutine(coro):
+                coro.close()
+        self.pending_tasks = []
+
+    def simulate(self, steps):
+        # Step the game without pacing or rendering (headless sessions, CI)
+        clock = self.frame_clock
+        for _ in range(steps):
+            if not self.running:
+                break
+            self.systems.begin_frame()
             self.events()
             self.update()
-            self.draw()
-            pygame.time.Clock().tick(FPS)
+            clock.step()
+
+    def start_recording(self):
+        # Record input from the next frame on; the game must not have
+        # simulated anything yet, or the replay starts from a different state
+        self.recording = InputRecording(self.seed, self.level_path)
+        return self.recording
+
+    def save_recording(self, path):
+        recording = self.recording
+        recording.digest = self.state_digest()
+        recording.save(path)
+        return recording
+
+    def replay(self, recording):
+        # Re-run a recorded session on a fresh Game(seed=recording.seed,
+        # level=recording.level): same input, same steps per frame, no
+        # pacing or rendering. Returns True if the final state matches
+        clock = self.frame_clock
+        for steps, events, mouse in recording.frames():
+            self.systems.begin_frame()
+            self.events((events, mouse))
+            for _ in range(steps):
+                self.update()
+                clock.step()
+            if not self.running:
+                break
+        return self.state_digest() == recording.digest
+
+    def state_digest(self):
+        # Fingerprint of the simulation state: bodies, player, quizzes, RNG
+        digest = hashlib.blake2b(digest_size=16)
+        physics = self.physics
+        digest.update(physics.pos.tobytes())
+        digest.update(physics.vel.tobytes())
+        player = self.player
+        digest.update(repr((player.rect, player.jumping, player.double_jump_available,
+                            player.facing_right, sorted(self.keys_held))).encode())
+        for npc in self.npcs:
+            quiz = npc.quiz
+            if quiz is not None:
+                digest.update(repr((quiz.question_id, quiz.score, quiz.show_dialog,
+                                    quiz.timer_steps, quiz.scheduler.turn)).encode())
+        digest.update(repr(self.rng.getstate()).encode())
+        return digest.digest()
+
+    @property
+    def frame_timings(self):
+        return self.frame_clock.timings
+
+    @property
+    def loop_stats(self):
+        return self.frame_clock.stats()
 
     def set_music_volume(self, volume):
         try:
-            pygame.mixer.music.set_volume(volume)
-        except:
-            print("Could not adjust music volume")
+            self.audio.set_volume(volume)
+        except pygame.error:
+            log.warning("Could not adjust music volume")
 
     def toggle_music(self):
         try:
-            if pygame.mixer.music.get_busy():
-                pygame.mixer.music.pause()
-            else:
-                pygame.mixer.music.unpause()
-        except:
-            print("Could not toggle music")
+            self.audio.toggle_music()
+        except pygame.error:
+            log.warning("Could not toggle music")
 
     def quit(self):
         pygame.quit()
         sys.exit()
 # Main game loop
+async def main(max_frames=None, trace_path=None, record_path=None, seed=None):
+    game = Game(seed=seed)
+    if trace_path:
+        game.start_trace()
+    if record_path:
+        game.start_recording()
+    start = time.perf_counter()
+    try:
+        await game.run_async(max_frames)
+    finally:
+        if trace_path:
+            log.info("Trace written to %s", game.export_trace(trace_path))
+        if record_path:
+            recording = game.save_recording(record_path)
+            log.info("Recorded %d frames (seed %d) to %s", len(recording), game.seed, record_path)
+    if game.headless:
+        elapsed = time.perf_counter() - start
+        frames = game.frame_clock.frame
+        log.info("Simulated %d frames in %.2f s (%.0f frames/s)",
+                 frames, elapsed, frames / elapsed if elapsed else 0)
+
+
+def replay(path):
+    # Headless, unpaced replay of a recorded session
+    recording = InputRecording.load(path)
+    game = Game(headless=True, quiz_log="", seed=recording.seed, level=recording.level)
+    start = time.perf_counter()
+    matches = game.replay(recording)
+    elapsed = time.perf_counter() - start
+    log.info("Replayed %d frames in %.2f s (%.0fx real time)", len(recording), elapsed,
+             game.frame_clock.sim_time / elapsed if elapsed else 0)
+    if matches:
+        log.info("Final state matches the recording")
+    else:
+        log.warning("Replay diverged from the recording: final state differs")
+    return matches
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adventure Game")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without window, audio or rendering")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="stop after this many frames")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="redraw only changed screen regions")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="write a Chrome trace (chrome://tracing) of the run on exit")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record the session's input to PATH on exit")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="replay a recorded session headless, as fast as possible")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the game's random generator (default: random)")
+    parser.add_argument("--log-level", default=LOG_LEVEL,
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], type=str.upper,
+                        help="drop log messages below this level (default: %(default)s)")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
     try:
-        game = Game()
-        game.run()
+        if args.replay:
+            replay(args.replay)
+        else:
+            asyncio.run(main(args.frames, args.trace, args.record, args.seed))
     except Exception as e:
-        print(f"Error: {e}")
-        traceback.print_exc()
+        log.exception("Error: %s", e)
     finally:
         pygame.quit()
         sys.exit()
\ No newline at end of file
@@ -0,0 +1,40 @@
+import os
+import math
+
+# Only TileMap is needed: no window, no audio device
+os.environ.setdefault("P5_HEADLESS", "1")
+
+import main
+
+# Ground row 64 px above the bottom edge, grass at the left end and dirt
+# elsewhere, and three platforms given as (x, y, tiles, terrain) in pixels.
+# Pixel positions are snapped to the nearest tile; the grid covers the whole
+# screen, so its last column sticks out past the right edge
+GROUND_Y = main.HEIGHT - 64
+PLATFORMS = [
+    (200, main.HEIGHT - 200, 5, "stone"),
+    (500, main.HEIGHT - 300, 7, "grass"),
+    (800, main.HEIGHT - 150, 4, "stone"),
+]
+
+
+def build_level1():
+    ts = main.TILE_SIZE
+    tilemap = main.TileMap(math.ceil(main.WIDTH / ts), math.ceil(main.HEIGHT / ts),
+                           ("grass", "dirt", "stone"), ts)
+    ground = round(GROUND_Y / ts)
+    tilemap.fill(0, ground, tilemap.width, 1, "dirt")
+    tilemap.set(0, ground, "grass")
+    for x, y, width, terrain_type in PLATFORMS:
+        tilemap.fill(round(x / ts), round(y / ts), width, 1, terrain_type)
+    return tilemap
+
+
+# Every level shipped in levels/ and the function that builds it
+LEVELS = {main.LEVEL_PATH: build_level1}
+
+if __name__ == "__main__":
+    # Run from the repository root: python make_levels.py
+    for path, build in LEVELS.items():
+        build().save(path)
+        print(f"{path}: {os.path.getsize(path)} bytes")